@@ -0,0 +1,89 @@
+"""Check that -C --background and --each --background hand the caller's stdout back at once.
+
+Each case runs opslog in a fresh interpreter with its stdout on a pipe, as $(...) or '| cat'
+would, and reads that pipe to EOF. The detached commands sleep for _sleep_s, so a child that
+kept the pipe open holds the read for that long. The run fails if any read takes longer than
+the bound, or if a command's outcome is not recorded once it ends.
+
+    python bench/bench_background.py [--bound S]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The commands outlive the bound by far, so only a child that let go of the pipe passes.
+# Interpreter startup and logging the entries take well under a second.
+_sleep_s = 5
+_bound_s = 2.0
+
+_run = """
+import sys
+sys.path.insert(0, {repo!r})
+import argparse, opslog
+opslog._logdir = {logdir!r}
+opslog._configfile = {config!r}
+try:
+    opslog.main(argparse.Namespace(p=None, i={targets!r}, C=[{command!r}], c=None, n=None, f=['bench'],
+                                   background=True, each={each!r}, jobs=8))
+except SystemExit:
+    pass
+"""
+
+_cases = {
+    'command': dict(targets=None, command='sleep {}'.format(_sleep_s), each=None),
+    'fanout': dict(targets=['10.0.0.0/30'], command='sleep {} # {{target}}'.format(_sleep_s), each=''),
+}
+
+
+def _read_to_eof(script):
+    # Seconds until the pipe holding the run's stdout reaches EOF
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdout.read()
+    elapsed = time.perf_counter() - start
+    process.stdout.close()
+    process.wait()
+    return elapsed
+
+
+def _outcomes(results_path):
+    try:
+        with open(results_path) as results:
+            return len(results.readlines()) - 1
+    except FileNotFoundError:
+        return 0
+
+
+def run(bound):
+    passed = True
+    for name, fields in _cases.items():
+        with tempfile.TemporaryDirectory() as scratch:
+            config = os.path.join(scratch, 'config.ini')
+            with open(config, 'w') as cfgfile:
+                cfgfile.write("[Program Info]\nversion = 1.8\n\n[Operator Settings]\ncurrent operator = bench\n")
+            elapsed = _read_to_eof(_run.format(repo=_repo, logdir=scratch + '/', config=config, **fields))
+
+            # The commands still end and record their outcomes after the caller is gone
+            expected = 1 if fields['each'] is None else 2
+            deadline = time.monotonic() + _sleep_s + 30
+            while _outcomes(os.path.join(scratch, 'bench_ops_log.results')) < expected and time.monotonic() < deadline:
+                time.sleep(0.2)
+            recorded = _outcomes(os.path.join(scratch, 'bench_ops_log.results'))
+
+        ok = elapsed <= bound and recorded == expected
+        passed &= ok
+        print("{:<8} pipe at EOF after {:5.2f} s (bound {} s), {} of {} outcomes recorded{}".format(
+            name, elapsed, bound, recorded, expected, '' if ok else '  FAILED'))
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that background runs do not hold the caller\'s stdout')
+    parser.add_argument('--bound', type=float, default=_bound_s, help='allowed seconds until EOF')
+    options = parser.parse_args()
+    sys.exit(0 if run(options.bound) else 1)
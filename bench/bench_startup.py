@@ -0,0 +1,69 @@
+"""Measure the startup cost of the opslog append path (-n, -c, -o) against its budget.
+
+Each sample runs a fresh interpreter that imports opslog, points it at a scratch log
+directory and writes one entry, so interpreter startup, module import and config parsing
+are all included. The run fails if the median exceeds the budget or if pandas was imported.
+
+    python bench/bench_startup.py [-n SAMPLES] [--budget MS]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measured with a warm page cache: bare 'python -c pass' ~20 ms, opslog append ~85 ms.
+# While pandas was imported at module level the append took ~850 ms. The budget is the
+# opslog overhead on top of a bare interpreter.
+_budget_ms = 100
+
+_append = """
+import sys
+sys.path.insert(0, {repo!r})
+import argparse, opslog
+opslog._logdir = {logdir!r}
+opslog._configfile = {config!r}
+try:
+    opslog.main(argparse.Namespace(p=[3], i=['10.0.0.1/32'], C=None, c=['nmap -sS 10.0.0.1'],
+                                   n=['bench note'], f=['bench'], each=None))
+except SystemExit:
+    pass
+if 'pandas' in sys.modules:
+    sys.exit('pandas was imported on the append path')
+"""
+
+
+def _time_run(argv):
+    start = time.perf_counter()
+    if subprocess.run(argv).returncode != 0:
+        sys.exit("append run failed")
+    return (time.perf_counter() - start) * 1000
+
+
+def run(samples, budget):
+    with tempfile.TemporaryDirectory() as scratch:
+        config = os.path.join(scratch, 'config.ini')
+        with open(config, 'w') as cfgfile:
+            cfgfile.write("[Program Info]\nversion = 1.8\n\n[Operator Settings]\ncurrent operator = bench\n")
+        script = _append.format(repo=_repo, logdir=scratch + '/', config=config)
+
+        bare = statistics.median(_time_run([sys.executable, '-c', 'pass']) for _ in range(samples))
+        append = statistics.median(_time_run([sys.executable, '-c', script]) for _ in range(samples))
+
+    overhead = append - bare
+    print("bare interpreter: {:8.1f} ms".format(bare))
+    print("opslog append:    {:8.1f} ms".format(append))
+    print("overhead:         {:8.1f} ms (budget {} ms)".format(overhead, budget))
+    return overhead <= budget
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure opslog append-path startup')
+    parser.add_argument('-n', dest='samples', type=int, default=15, help='number of samples')
+    parser.add_argument('--budget', type=float, default=_budget_ms, help='allowed overhead in ms')
+    options = parser.parse_args()
+    sys.exit(0 if run(options.samples, options.budget) else 1)
@@ -0,0 +1,188 @@
+"""Time every opslog entry point against synthetic logs and compare with stored baselines.
+
+For each size a log is generated once (see generate_log.py) and kept in the data directory,
+along with a smaller second log used as the other input of --merge. Each case then runs in a
+fresh interpreter that imports opslog and points it at that directory. The case reports the
+wall time of the call itself, without interpreter startup. Peak RSS is taken from the child's
+resource usage. Cases that write to the log run against a fresh copy of the data directory,
+so every case and every run sees the same log.
+
+Baselines live in baselines.json next to this file. A case fails when its time or peak RSS is
+more than --tolerance times its baseline. Baselines depend on the machine, so record your own
+with --save before relying on the comparison.
+
+    python bench/bench_suite.py [--sizes 10k 1m 10m] [--cases cat ...] [--data DIR] [--save]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generate_log
+
+_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_baselines = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+_sizes = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+# A case fails when it is this many times slower or bigger than its baseline
+_tolerance = 1.5
+
+# Runs in the child: the case's setup, then its code, which is the part that is timed
+_case = """
+import sys, os, glob, time, json, builtins, argparse
+sys.path.insert(0, {repo!r})
+import opslog
+opslog._logdir = {logdir!r}
+opslog._configfile = {config!r}
+log_path = opslog._log_path('bench')
+answers = []
+builtins.input = lambda prompt='': answers.pop(0)
+{setup}
+start = time.perf_counter()
+try:
+{code}
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+with open({result!r}, 'w') as result:
+    json.dump(elapsed, result)
+"""
+
+_append = """for _ in range({appends}):
+    try:
+        opslog.main(argparse.Namespace(p=[3], i=['10.0.0.1/32'], C={C!r}, c={c!r},
+                                       n=['bench note'], f=['bench'], background=False, each=None))
+    except SystemExit:
+        pass"""
+
+# name: (setup, code, entries handled, either a count or a key of the size's meta.json). Code sees
+# log_path, the other merge input as merge_path, the window as since/until and a scratch file as out.
+_cases = {
+    'index_build': ("[os.remove(path) for path in glob.glob(log_path[:-len('.csv')] + '.*') if path != log_path]",
+                    "for kind in opslog._index_kinds: opslog._build_index(log_path, kind)", 'entries'),
+    'cat_cold': ("[os.remove(path) for path in glob.glob(opslog._logdir + '*.cache')]",
+                 "opslog.show_log(*opslog._cat_rows())", 'entries'),
+    'cat': ("", "opslog.show_log(*opslog._cat_rows())", 'entries'),
+    'cat_window': ("", "opslog.show_log(*opslog._cat_rows(since, until))", 'window'),
+    'cat_tail': ("", "opslog.show_log(*opslog._cat_rows(tail=50))", 50),
+    'show': ("opslog._entry_offsets(log_path)", "opslog.show_log(*opslog._show_rows(5001, 5050))", 50),
+    'list_flags': ("", "opslog.list_flags()", 'entries'),
+    'stats': ("", "opslog.log_stats()", 'entries'),
+    'stats_window': ("", "opslog.log_stats(since, until)", 'window'),
+    'search_log': ("", "opslog.show_log(opslog.search_log(['creds', 'flag7']))", 'entries'),
+    'export_csv': ("", "opslog._export_log(out, 'csv')", 'entries'),
+    'export_json': ("", "opslog._export_log(out, 'json')", 'entries'),
+    'export_ndjson': ("", "opslog._export_log(out, 'ndjson')", 'entries'),
+    'export_default': ("", "opslog._export_log(out, 'default')", 'entries'),
+    'merge': ("answers.extend([out, 'csv'])", "opslog._merge_logs([log_path, merge_path])", 'merge'),
+    'append': ("", _append.format(appends=200, C=None, c=['nmap -sS 10.0.0.1']), 200),
+    'run_command': ("", _append.format(appends=5, C=['true'], c=None), 5),
+    'fanout': ("", "opslog._run_fanout('true {target}', ['10.0.0.{}'.format(n) for n in range(1, 9)], 4, p='', f='bench', n='')", 8),
+}
+
+# Cases that add entries or outcomes to the log they run against
+_writes = {'append', 'run_command', 'fanout'}
+
+
+def _prepare(data, size):
+    # Generate the logs for a size unless they are already in the data directory
+    logdir = os.path.join(data, size) + '/'
+    meta_path = os.path.join(logdir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as meta:
+            return logdir, json.load(meta)
+
+    os.makedirs(logdir, exist_ok=True)
+    count = _sizes[size]
+    print("generating {} entries in {}".format(count, logdir))
+    first, last = generate_log.generate(os.path.join(logdir, 'bench_ops_log.csv'), count)
+    generate_log.generate(os.path.join(data, size + '_merge.csv'), max(1, count // 10), 'other', seed=2)
+    with open(os.path.join(logdir, 'config.ini'), 'w') as config:
+        config.write("[Program Info]\nversion = 1.8\n\n[Operator Settings]\ncurrent operator = bench\n")
+
+    # The window covers the tenth of the log in the middle
+    with open(os.path.join(logdir, 'bench_ops_log.csv')) as log:
+        log.readline()
+        dates = [line[:19] for n, line in enumerate(log) if n in (count * 45 // 100, count * 55 // 100)]
+    meta = {'entries': count, 'first': first, 'last': last, 'since': dates[0], 'until': dates[-1],
+            'window': count // 10, 'merge': count + max(1, count // 10)}
+    with open(meta_path, 'w') as out:
+        json.dump(meta, out)
+    return logdir, meta
+
+
+def _run_case(name, logdir, data, size, meta):
+    # Run one case in a fresh interpreter and return (seconds, peak RSS in MB)
+    setup, code, _ = _cases[name]
+    with tempfile.TemporaryDirectory() as scratch:
+        if name in _writes:
+            logdir = shutil.copytree(logdir, os.path.join(scratch, 'logs')) + '/'
+        result = os.path.join(scratch, 'result.json')
+        out = os.path.join(scratch, 'out')
+        setup = "merge_path = {!r}\nsince, until = {!r}, {!r}\nout = {!r}\n{}".format(
+            os.path.join(data, size + '_merge.csv'), meta['since'], meta['until'], out, setup)
+        script = _case.format(repo=_repo, logdir=logdir, config=os.path.join(logdir, 'config.ini'),
+                              setup=setup, code='\n'.join('    ' + line for line in code.splitlines()),
+                              result=result)
+
+        process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0 or not os.path.exists(result):
+            sys.exit("case {} failed on the {} log".format(name, size))
+        with open(result) as elapsed:
+            return json.load(elapsed), usage.ru_maxrss / 1024
+
+
+def run(sizes, cases, data, tolerance, save):
+    try:
+        with open(_baselines) as baselines_file:
+            baselines = json.load(baselines_file)
+    except FileNotFoundError:
+        baselines = dict()
+
+    passed = True
+    print("{:<6} {:<15} {:>10} {:>10} {:>14} {:>10}  {}".format(
+        'size', 'case', 'seconds', 'peak MB', 'entries/s', 'baseline', 'status'))
+    for size in sizes:
+        logdir, meta = _prepare(data, size)
+        for name in cases:
+            seconds, rss = _run_case(name, logdir, data, size, meta)
+            handled = _cases[name][2]
+            handled = meta[handled] if isinstance(handled, str) else handled
+            baseline = baselines.get(size, {}).get(name)
+
+            status = 'new'
+            if baseline:
+                slow = seconds > baseline['seconds'] * tolerance
+                big = rss > baseline['rss_mb'] * tolerance
+                status = 'SLOWER' if slow else 'BIGGER' if big else 'ok'
+                passed = passed and not slow and not big
+            print("{:<6} {:<15} {:>10.3f} {:>10.1f} {:>14,.1f} {:>10}  {}".format(
+                size, name, seconds, rss, handled / seconds if seconds else 0,
+                '{:.3f}'.format(baseline['seconds']) if baseline else '-', status))
+            if save:
+                baselines.setdefault(size, {})[name] = {'seconds': round(seconds, 4), 'rss_mb': round(rss, 1)}
+
+    if save:
+        with open(_baselines, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+            baselines_file.write("\n")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every opslog entry point')
+    parser.add_argument('--sizes', nargs='+', choices=list(_sizes), default=['10k'], help='log sizes to run')
+    parser.add_argument('--cases', nargs='+', choices=list(_cases), default=list(_cases), help='cases to run')
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'opslog-bench'),
+                        help='directory the generated logs are kept in between runs')
+    parser.add_argument('--tolerance', type=float, default=_tolerance, help='allowed slowdown against baselines')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    options = parser.parse_args()
+    sys.exit(0 if run(options.sizes, options.cases, options.data, options.tolerance, options.save) else 1)
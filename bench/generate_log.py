@@ -0,0 +1,100 @@
+"""Generate a synthetic operator log for benchmarking.
+
+Entries are in date order a few seconds apart and look like a working session: a handful of
+common flags and many rare ones, targets spread over a few networks as single hosts, /24s and
+the odd /16, command syntax drawn from the usual tools and free text notes.
+
+    python bench/generate_log.py FILE [-n ENTRIES] [--operator NAME] [--seed N]
+"""
+import argparse
+import datetime
+import random
+
+_header = 'Date;Operator;Flag;PAA;IPs;Command Syntax;Executed;Note'
+
+# A few flags tag most entries, the rest turn up now and then
+_common_flags = ['recon', 'web', 'creds', 'lateral', 'exfil', 'persist']
+_rare_flags = ['flag{}'.format(n) for n in range(40)]
+
+_networks = ['10.{}.{}'.format(a, b) for a in (0, 1, 10) for b in range(0, 40)] + \
+            ['172.16.{}'.format(b) for b in range(16)] + ['192.168.{}'.format(b) for b in range(8)]
+
+_commands = [
+    'nmap -sS -p- {ip}',
+    'nmap -sV -sC -p 22,80,443 {ip}',
+    'curl -sk https://{ip}/login',
+    'gobuster dir -u http://{ip}/ -w common.txt',
+    'ssh admin@{ip}',
+    'smbclient -L //{ip}/ -N',
+    'hydra -L users.txt -P pass.txt ssh://{ip}',
+    'crackmapexec smb {ip} -u svc -p Winter2024',
+    'scp loot.tar.gz op@{ip}:/tmp/',
+    'ping -c 3 {ip}',
+]
+
+_notes = [
+    'initial scan of the segment',
+    'found open port, following up',
+    'login page looks default',
+    'credentials from share reused here',
+    'host did not respond',
+    'pivoting through this box',
+    'collected config files',
+    'service banner suggests an old version',
+    '',
+]
+
+
+def _target(rng):
+    # Mostly single hosts, then /24s, a few /16s and sometimes two targets at once
+    network = rng.choice(_networks)
+    kind = rng.random()
+    if kind < 0.7:
+        return '{}.{}'.format(network, rng.randint(1, 254))
+    if kind < 0.9:
+        return '{}.0/24'.format(network)
+    if kind < 0.95:
+        return '{}.0.0/16'.format(network.rsplit('.', 1)[0])
+    return '{}.{} {}.{}'.format(network, rng.randint(1, 254), network, rng.randint(1, 254))
+
+
+def entries(count, operator='bench', seed=1, start=datetime.datetime(2024, 1, 1)):
+    """Yield count log lines (without newlines), oldest first"""
+    rng = random.Random(seed)
+    date = start
+    for number in range(count):
+        date += datetime.timedelta(seconds=rng.randint(1, 10))
+        flags = rng.sample(_common_flags, rng.choice((0, 1, 1, 1, 2)))
+        if rng.random() < 0.1:
+            flags.append(rng.choice(_rare_flags))
+        target = _target(rng) if rng.random() < 0.9 else ''
+        command = rng.choice(_commands).format(ip=target.split(' ')[0].split('/')[0]) if rng.random() < 0.8 else ''
+        executed = rng.choice(('yes', 'no')) if command else ''
+        note = rng.choice(_notes)
+        if rng.random() < 0.3:
+            note = '{} (step {})'.format(note, number)
+        yield ';'.join([date.strftime('%Y-%m-%d %H:%M:%S'), operator, ' '.join(flags),
+                        str(rng.randint(1, 30)) if rng.random() < 0.7 else '', target, command, executed, note])
+
+
+def generate(path, count, operator='bench', seed=1):
+    """Write a log of count entries to path and return the dates of its first and last entry"""
+    first = last = ''
+    with open(path, 'w', buffering=1 << 20) as log:
+        log.write(_header + "\n")
+        for line in entries(count, operator, seed):
+            first = first or line[:19]
+            last = line[:19]
+            log.write(line + "\n")
+    return first, last
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic operator log')
+    parser.add_argument('file', help='log file to write')
+    parser.add_argument('-n', dest='count', type=int, default=10000, help='number of entries')
+    parser.add_argument('--operator', default='bench', help='operator name in the entries')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    options = parser.parse_args()
+    print("{} entries from {} to {}".format(options.count, *generate(options.file, options.count,
+                                                                        options.operator, options.seed)))
@@ -2,16 +2,32 @@ import argparse
 from configparser import ConfigParser
 import re
 import datetime
+import time
 import sys
-from csv import DictReader
 import json
+import atexit
+import contextlib
+import shlex
+import ipaddress
+import itertools
+import functools
+import collections
+import gzip
+import zlib
+import struct
 from shutil import copyfile
 from shutil import copytree
 from shutil import rmtree
 import os
 import subprocess
-from pandas import read_csv, set_option
-from tempfile import NamedTemporaryFile
+import fcntl
+import socket
+import selectors
+import signal
+import heapq
+import mmap
+from tempfile import TemporaryFile
+from tempfile import TemporaryDirectory
 
 
 _desc = """
@@ -50,6 +66,9 @@ Logging arguments:
   -p #                  The pre-approved action number
   -i a.b.c.d/f          The target ip address/range
   -C 'Command'          Command syntax to log before executing
+  --background          With -C, run the command detached and log its outcome when it ends
+  --each [FILE]         With -C, log and run the command once per target of FILE (or stdin) or host of the -i range, {target} in it replaced by each
+  --jobs N              With --each, how many commands run at once (default 8)
   -c 'Command'          Command syntax to log without executing
   -n 'text'             Operator notes to include in the log entry
   -f Flag [Flag ...]    Flag(s) used to tag the log entry
@@ -61,15 +80,40 @@ Output Arguments:
   --cat                 Output the current log (can be piped to less/more,
                         head/tail)
   -lf                   List all flags used in current operators log
+  --show N[..M]         Show entry N, or entries N to M, of the current log as numbered by --cat and -lf
+  --follow [Flag ...]   Print entries as they are logged (with --tail N, the last N first), only those tagged with a Flag if given
+  --stats               Report entries per flag, PAA, target, day and hour and the failed command rate
   -sf Flag [Flag ...]   Search the log entries for those tagged with Flag(s)
+  --grep TEXT [TEXT ...], --search TEXT [TEXT ...]
+                        Search the notes and command syntax for entries containing every TEXT
+  --target a.b.c.d/f    Show the entries whose target ip address/range overlaps a.b.c.d/f
+  --since TIME          Only include entries logged at or after TIME (UTC)
+  --until TIME          Only include entries logged up to and including TIME (UTC)
+                        TIME is YYYY-MM-DD [HH[:MM[:SS]]] and works with --cat, -sf, --grep, --target, --stats and --export
+  --all-operators       Run --cat, -sf, --follow, --stats or --export over every operator's log, merged by date
+  --head N              Only show the first N entries of --cat, -sf, --grep or --target
+  --tail N              Only show the last N entries of --cat, -sf, --grep or --target, or start --follow with them
 
 
 Management Arguments:
   Use the following commands to manage the operator log
 
-    --export FILE         Export the current log
-    --format FILETYPE     Format to use when exporting the log(csv, json, or default)
+    --export FILE         Export the current log (gzip compressed if FILE ends in .gz)
+    --format FILETYPE     Format to use when exporting the log(csv, json, ndjson, or default)
+    --incremental         With --export, only add the entries logged since the last --incremental export
     --merge F1 F2 [F3...] Merge multiple log files together into one log
+    --quarantine FILE     With --merge, move lines that do not match the log format to FILE
+    --batch [FILE]        Log one entry per line of FILE (or stdin), as JSON or -p/-i/-c/-n/-f options
+    --import FILE         Load the entries of the csv log FILE into the sqlite backend
+    --daemon              Run opslogd, which batches log entries from many shells
+
+
+Diagnostic Arguments:
+  Use the following commands to see where an invocation spends its time
+
+    --timings             Print the time taken by each phase to stderr
+    --profile FILE        Write a cProfile dump of the invocation to FILE
+                          Set OPSLOG_STATS=FILE to append a JSON line of timings per invocation to FILE
 
 
 
@@ -85,9 +129,99 @@ or in the /usr/lib/ops_log/help/OpsLog.pdf user manual.
 _logdir = '/usr/lib/ops_log/operator_logs/'
 _aliasfile = '/etc/profile.d/opslog_alias.sh'
 _configfile = '/usr/lib/ops_log/config.ini'
+_socketfile = '/usr/lib/ops_log/opslogd.sock'
 _version = 1.8
-set_option('display.expand_frame_repr', False)
-set_option('display.colheader_justify', 'center')
+_log_header = 'Date;Operator;Flag;PAA;IPs;Command Syntax;Executed;Note'
+
+# pandas and the current operator are loaded on first use and then kept for the life of the process.
+# Importing pandas costs far more than writing an entry, so the logging paths (-n, -c, -C, -o, -so)
+# must never call _pandas()
+_pd = None
+_operator = None
+_config = None
+
+
+# Timings
+#
+# The phases of an invocation are timed with _timed(), as a decorator or a with block. Phases nest
+# and each only counts the time not spent in the phases inside it, so together they add up to the
+# whole run. --timings prints them to stderr, --profile FILE writes a cProfile dump, and with
+# OPSLOG_STATS=FILE in the environment every invocation appends one JSON line of timings to FILE.
+_stats_variable = 'OPSLOG_STATS'
+_phase_times = dict()
+_phase_stack = list()
+
+
+@contextlib.contextmanager
+def _timed(phase):
+    now = time.perf_counter()
+    if _phase_stack:
+        parent = _phase_stack[-1]
+        _phase_times[parent[0]] = _phase_times.get(parent[0], 0) + now - parent[1]
+    _phase_stack.append([phase, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        _phase_times[phase] = _phase_times.get(phase, 0) + now - _phase_stack.pop()[1]
+        if _phase_stack:
+            _phase_stack[-1][1] = now
+
+
+def _process_age():
+    # Seconds since this process was started, or None where /proc cannot tell
+    try:
+        with open('/proc/self/stat') as stat:
+            started = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            return float(uptime.read().split()[0]) - started / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _report_timings(started, startup, show, profiler=None, profile=None, options=()):
+    # Run at exit. started is the perf_counter() value and startup the process age when the
+    # command line was read; everything before that counts as startup. options names the
+    # options that were given
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+
+    phases = [('startup', startup or 0)] + list(_phase_times.items())
+    total = (startup or 0) + time.perf_counter() - started
+    phases.append(('other', total - sum(seconds for _, seconds in phases)))
+
+    if show:
+        print("\nopslog timings (ms):", file=sys.stderr)
+        for phase, seconds in phases + [('total', total)]:
+            print("  {:<15} {:>10.1f}".format(phase, seconds * 1000), file=sys.stderr)
+
+    # Only option names are recorded, never the notes or commands given with them
+    stats = os.environ.get(_stats_variable)
+    if stats:
+        record = {'date': datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), 'host': socket.gethostname(),
+                  'options': list(options),
+                  'total_ms': round(total * 1000, 2),
+                  'phases_ms': {phase: round(seconds * 1000, 2) for phase, seconds in phases}}
+        try:
+            fd = os.open(stats, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(record) + "\n").encode('utf-8'))
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
+def _pandas():
+    global _pd
+    if _pd is None:
+        with _timed('pandas import'):
+            import pandas
+            pandas.set_option('display.expand_frame_repr', False)
+            pandas.set_option('display.colheader_justify', 'center')
+        _pd = pandas
+    return _pd
 
 
 def _upgrade_opslog():
@@ -129,8 +263,7 @@ def _upgrade_opslog():
 
                 # if everything so far was successful, update config.ini with new version number
                 config.set("Program Info", "Version", str(_version))
-                with open(_configfile, 'w') as cfgfile:
-                    config.write(cfgfile)
+                _write_config(config)
 
                 print('Upgrade Successful')
 
@@ -174,8 +307,7 @@ def _install_opslog():
         config.add_section('Operator Settings')
         config.set('Operator Settings', 'Current Operator', input_operator)
 
-        with open("/usr/lib/ops_log/config.ini", 'w') as cfgfile:
-            config.write(cfgfile)
+        _write_config(config, "/usr/lib/ops_log/config.ini")
 
         os.chmod("/usr/lib/ops_log/config.ini", 0o666)
 
@@ -222,44 +354,1655 @@ def _install_opslog():
     sys.exit()
 
 
+@_timed('config')
+def _read_config():
+    global _config
+    if _config is None:
+        _config = ConfigParser()
+        _config.read(_configfile)
+    return _config
+
+
 def get_operator():
     # print(os.getenv('OPS_LOG_USER'))
-    config = ConfigParser()
-    config.read(_configfile)
-    return config.get("Operator Settings", "Current Operator")
+    global _operator
+    if _operator is None:
+        _operator = _read_config().get("Operator Settings", "Current Operator")
+    return _operator
 
 
 def set_operator(value):
+    global _operator
 
     config = ConfigParser()
     config.read(_configfile)
     config.set("Operator Settings", "Current Operator", value)
-    with open(_configfile, 'w') as cfgfile:
-        config.write(cfgfile)
+    try:
+        _write_config(config)
+    except OSError as e:
+        print("ERROR: could not save the new operator: {}".format(e))
+        sys.exit(1)
+    _operator = value
     print("New operator set")
     sys.exit()
 
 
+def _log_path(operator=None):
+    return os.path.join(_logdir, (operator or get_operator()) + "_ops_log.csv")
+
+
+def _operators():
+    operators = list()
+    for name in sorted(os.listdir(_logdir)):
+        # An operator whose log has been rotated may only have a segment manifest left, and one using
+        # the sqlite backend only a database
+        operator = re.split("_ops_log.csv|_ops_log.manifest|_ops_log.db", name)[0]
+        if name.endswith(("_ops_log.csv", "_ops_log.manifest", "_ops_log.db")) and operator not in operators:
+            operators.append(operator)
+    return operators
+
+
 def list_operators():
     print("Logs exist for the following operators:")
-    operators = os.listdir(_logdir)
-    for name in operators:
-        print("\t" + re.split("_ops_log.csv", name)[0])
+    for name in _operators():
+        print("\t" + name)
     sys.exit()
 
 
-def _get_log():
+def _get_log(since=None, until=None, all_operators=False):
 
-    try:
+    if all_operators:
+        return _all_operators_log(since=since, until=until)
 
-        log = read_csv(os.path.join(_logdir, get_operator() + "_ops_log.csv"), delimiter=';').fillna('')
-        log.index += 1
+    try:
+        log = _db_log(_log_path(), since, until) if _backend() == 'sqlite' else _cached_log(_log_path(), since, until)
     except FileNotFoundError:
         print("No log for current operator.")
         sys.exit()
     return log
 
 
+def _log_parts(log_path, since=None, until=None):
+    # [(path, number of its first entry), ...] for the closed segments of a log that overlap the
+    # time window, oldest first, followed by the log itself
+    segments = _load_manifest(log_path)
+    parts = [(segment[0], segment[1]) for segment in segments
+             if not (since and segment[4] < since) and not (until and segment[3][:len(until)] > until)]
+    parts.append((log_path, _entry_base(log_path, segments) + 1))
+    return parts
+
+
+@_timed('parse')
+def _cached_log(log_path, since=None, until=None):
+    # Load the log and its closed segments from their parse caches, with command outcomes joined on.
+    # Closed segments come before the current log so entry numbers run on across them. With a time
+    # window, segments outside it are skipped and only the rows inside it are read
+    entries = list()
+    columns = None
+    for path, first in _log_parts(log_path, since, until):
+        header, values, row = _cached_columns(path, since, until)
+        entries.extend(range(first + row - 1, first + row - 1 + len(values[0])))
+        columns = values if columns is None else [old + new for old, new in zip(columns, values)]
+    log = _pandas().DataFrame(dict(zip(header, columns)), index=entries)
+    return _apply_outcomes(log, _load_outcomes(log_path))
+
+
+def _split_entry(line):
+    # Split a raw log line into its 8 fields. Any extra ';' is kept as part of the note
+    fields = line.rstrip('\r\n').split(';', 7)
+    return fields + [''] * (8 - len(fields))
+
+
+def _open_log(path):
+    # Closed segments are gzip compressed, the current log is not
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _read_entries_at(path, offsets):
+    # Read the entries starting at each of the given (ascending) byte offsets
+    rows = list()
+    with _open_log(path) as log:
+        for offset in offsets:
+            log.seek(offset)
+            rows.append(_split_entry(log.readline().decode('utf-8', 'replace')))
+    return rows
+
+
+def _entry_frame(entries, rows):
+    # Build the same table _get_log() would produce, restricted to the given entry numbers
+    return _pandas().DataFrame(rows, columns=_log_header.split(';'), index=entries)
+
+
+def _read_lines(log_path, start=0, end=None):
+    # Yield (offset, raw line) for every line of the log that starts in [start, end)
+    with open(log_path, 'rb') as log:
+        log.seek(start)
+        offset = start
+        for line in log:
+            if end is not None and offset >= end:
+                break
+            yield offset, line
+            offset += len(line)
+
+
+def _timestamp(value):
+    # argparse type for --since/--until: a UTC date, optionally followed by hours, minutes and seconds
+    value = value.strip().replace('T', ' ')
+    if not re.match(r"^\d{4}-\d{2}-\d{2}( \d{2}(:\d{2}(:\d{2})?)?)?$", value):
+        raise argparse.ArgumentTypeError("invalid time '{}', use YYYY-MM-DD [HH[:MM[:SS]]]".format(value))
+    return value
+
+
+def _network(value):
+    # argparse type for --target: an address or a CIDR range, host bits are ignored
+    try:
+        return ipaddress.ip_network(value.strip(), strict=False)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid target '{}', use a.b.c.d or a.b.c.d/f".format(value))
+
+
+def _entry_range(value):
+    # argparse type for --show: an entry number N or a range N..M, returned as (N, M)
+    match = re.match(r"^\s*(\d+)(?:\s*\.\.\s*(\d+))?\s*$", value)
+    first, last = (int(match.group(1)), int(match.group(2) or match.group(1))) if match else (0, 0)
+    if not 1 <= first <= last:
+        raise argparse.ArgumentTypeError("invalid entries '{}', use N or N..M counting from 1".format(value))
+    return first, last
+
+
+def _log_window(log_path, since=None, until=None):
+    """Return (start, end, first entry number) of the entries dated between since and until.
+
+    Entries are appended in date order, so both ends are found by bisecting the entries through
+    the offsets file, which also gives the number of the first one, and nothing outside the window
+    is read. until includes everything that starts with it, so '--until 2019-06-11' covers the
+    whole day.
+    """
+    with open(log_path, 'rb') as log:
+        size = _intact_end(log_path, os.fstat(log.fileno()))
+        if not since and not until:
+            return len(log.readline()), size, 1
+        offsets = _entry_offsets(log_path)
+
+        def bisect(lo, past):
+            # First entry from lo on whose date past() accepts. It goes from false to true only once
+            hi = len(offsets)
+            while lo < hi:
+                middle = (lo + hi) // 2
+                log.seek(int(offsets[middle]))
+                if past(log.read(19)):
+                    hi = middle
+                else:
+                    lo = middle + 1
+            return lo
+
+        first = bisect(0, lambda date: date >= since.encode()) if since else 0
+        last = bisect(first, lambda date: date[:len(until)] > until.encode()) if until else len(offsets)
+    return tuple(int(offsets[n]) if n < len(offsets) else size for n in (first, last)) + (first + 1,)
+
+
+def _log_lines(log_path, since=None, until=None):
+    """Yield (entry number, raw line) for every entry of the log and its closed segments, oldest first.
+
+    With since/until, segments outside the window are skipped using the time range in the manifest
+    and the current log is bisected, so only the entries in the window are read.
+    """
+    segments = _load_manifest(log_path)
+    for segment, first, _, first_date, last_date, _ in segments:
+        if (since and last_date < since) or (until and first_date[:len(until)] > until):
+            continue
+        entry = first
+        with gzip.open(segment, 'rb') as closed:
+            closed.readline()
+            for line in closed:
+                if not line.strip():
+                    continue
+                if (not since or line[:19] >= since.encode()) and (not until or line[:len(until)] <= until.encode()):
+                    yield entry, line
+                entry += 1
+
+    start, end, entry = _log_window(log_path, since, until)
+    entry += _entry_base(log_path, segments)
+    for _, line in _read_lines(log_path, start, end):
+        if line.strip():
+            yield entry, line
+            entry += 1
+
+
+# Entry offsets
+#
+# <operator>_ops_log.offsets holds the byte offset of every entry of the log as an array of int64,
+# after a fixed width '#opslog-offsets;size;mtime' line recording the state of the log it matches.
+# Entry n of the file starts at offsets[n - 1], so any entry is one seek away. The writer appends the
+# offsets of its entries and rewrites the state line in place while it holds the log lock. Readers
+# rebuild the file when the state does not match the log, which is also how a file the writer found
+# stale gets brought up to date. A closed segment gets <operator>_ops_log.<n>.offsets the first time
+# one of its entries is looked up.
+_offsets_state = '#opslog-offsets;{:020d};{:020d}\n'
+_offsets_start = len(_offsets_state.format(0, 0))
+
+# Bytes of the log scanned at a time when the offsets are rebuilt
+_offsets_block = 1 << 24
+
+
+def _offsets_path(path):
+    return _segment_index_path(path, 'offsets') if path.endswith('.gz') else _index_path(path, 'offsets')
+
+
+def _scan_offsets(log, size=None):
+    # Return the offsets of the entries of an open log or segment, up to offset size, as an int64 array
+    # along with the offset the last whole line ends at. Blank lines are not entries, and as an entry
+    # starts with a 19 character date only shorter lines need a closer look
+    import numpy
+    position = len(log.readline())
+    found = [numpy.zeros(0, '<i8')]
+    carry = b''
+    while size is None or position + len(carry) < size:
+        block = log.read(_offsets_block if size is None else min(_offsets_block, size - position - len(carry)))
+        if not block:
+            break
+        data = carry + block
+        ends = numpy.flatnonzero(numpy.frombuffer(data, 'u1') == 10)
+        if not len(ends):
+            carry = data
+            continue
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        keep = numpy.ones(len(starts), bool)
+        for n in numpy.flatnonzero(ends - starts < 19):
+            keep[n] = bool(data[starts[n]:ends[n]].strip())
+        found.append((starts[keep] + position).astype('<i8'))
+        carry = data[ends[-1] + 1:]
+        position += int(ends[-1]) + 1
+    return numpy.concatenate(found), position
+
+
+def _write_offsets(path, data):
+    # Replace the offsets file of a log or closed segment with data, its state line included
+    temp_path = _offsets_path(path) + '.tmp{}'.format(os.getpid())
+    with open(temp_path, 'wb') as sidecar:
+        sidecar.write(data)
+    os.replace(temp_path, _offsets_path(path))
+
+
+def _empty_offsets(log_path):
+    # Start the offsets file of a log that holds nothing but its header
+    stat = os.stat(log_path)
+    _write_offsets(log_path, _offsets_state.format(stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+
+
+def _build_offsets(path):
+    # Scan a log or closed segment and write its offsets file afresh. Returns the file's contents.
+    # A log ending in a line still being written or in a torn tail is recorded as stale, so the next
+    # reader rebuilds it
+    stat = os.stat(path)
+    with _open_log(path) as log:
+        if path.endswith('.gz'):
+            offsets, _ = _scan_offsets(log)
+            state = stat.st_size, stat.st_mtime_ns
+        else:
+            offsets, end = _scan_offsets(log, _intact_end(path, stat))
+            state = end, stat.st_mtime_ns if end == stat.st_size else 0
+    data = _offsets_state.format(*state).encode('utf-8') + offsets.tobytes()
+    try:
+        _write_offsets(path, data)
+    except OSError:
+        pass
+    return data
+
+
+def _entry_offsets(path):
+    """Return the offset of every entry of a log or closed segment as a sequence of int64, rebuilding the offsets file if stale.
+
+    The sequence is a view of the file itself, so looking up a few entries reads just those and does
+    not need numpy.
+    """
+    stat = os.stat(path)
+    try:
+        with open(_offsets_path(path), 'rb') as sidecar:
+            data = mmap.mmap(sidecar.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        data = None
+    if data is None or data[:_offsets_start] != _offsets_state.format(stat.st_size, stat.st_mtime_ns).encode('utf-8') \
+            or (len(data) - _offsets_start) % 8:
+        data = _build_offsets(path)
+    if sys.byteorder == 'little':
+        return memoryview(data)[_offsets_start:].cast('q')
+    import numpy
+    return numpy.frombuffer(data, '<i8', offset=_offsets_start)
+
+
+def _offsets_appended(log_path, before, offsets):
+    # Called by the writer while it holds the log lock, right after the entries at offsets were written.
+    # before is the stat of the log taken just before the write. A file that was already stale is left
+    # for the next reader to rebuild
+    stat = os.stat(log_path)
+    try:
+        with open(_offsets_path(log_path), 'r+b') as sidecar:
+            if sidecar.read(_offsets_start) != _offsets_state.format(before.st_size, before.st_mtime_ns).encode('utf-8'):
+                return
+            sidecar.seek(0, os.SEEK_END)
+            sidecar.write(struct.pack('<{}q'.format(len(offsets)), *offsets))
+            sidecar.seek(0)
+            sidecar.write(_offsets_state.format(stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    except FileNotFoundError:
+        pass
+
+
+# Index sidecars
+#
+# Each log has one sidecar index per kind in _index_kinds, named <operator>_ops_log.<kind>, that maps
+# every key of that kind (a flag, a word of the note or command syntax, a target network) to the
+# entries holding it.
+# The first line records the log size, mtime and entry count the index was compacted at, the number
+# of keys and the length of the postings block. Then comes one 'key;count;position;length' line per
+# key, then the postings block itself, so a lookup only reads the postings of the keys it needs.
+# Every append adds a journal line '+entry;offset;size;mtime;keys' so the writer never has to
+# rewrite the index. Readers fold the journal back in once it grows past _index_journal_max lines.
+# If the recorded size and mtime do not match the log, the index is stale and is rebuilt from the log.
+# The target index writes its keys in order of the addresses they cover and, after them, one fixed
+# width 'version start end position' record per key in the same order, its length recorded as a
+# last header field, so the networks overlapping a target are found by bisecting the records.
+_index_journal_max = 1000
+_bounds_record = '{:1d}{:039d}{:039d}{:020d}\n'
+_bounds_size = 100
+
+
+def _words(text):
+    # Lower case words of a note or command syntax, as kept in the word index
+    return set(re.findall(r"\w+", text.lower()))
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _target_key(target):
+    # Normal CIDR form of one target, or None if it is not an address or CIDR range (a host name, say).
+    # Logs name the same targets over and over, so parsed targets are remembered
+    try:
+        return str(ipaddress.ip_network(target, strict=False))
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _target_bounds(key):
+    # (IP version, first address, last address) of a target index key, as integers
+    network = ipaddress.ip_network(key)
+    return network.version, int(network[0]), int(network[-1])
+
+
+def _targets(text):
+    # Networks named in the IPs column, as kept in the target index
+    targets = set(_target_key(target) for target in re.split(r"[\s,]+", text.strip()))
+    targets.discard(None)
+    return targets
+
+
+_index_kinds = {
+    'flags': lambda fields: set(fields[2].split()),
+    'words': lambda fields: _words(fields[5] + ' ' + fields[7]),
+    'targets': lambda fields: _targets(fields[4]),
+}
+
+
+# Index kinds whose keys are ordered by the addresses they cover
+_index_bounds = {'targets': _target_bounds}
+
+
+def _overlapping(network):
+    # Key filter for the target index: networks that contain, fall inside or equal network.
+    # Two CIDR ranges either nest or are disjoint, so comparing the first and last address is enough.
+    # _read_index() uses the network it carries to bisect the bounds of a target index instead
+    first, last = int(network[0]), int(network[-1])
+
+    def match(key):
+        version, start, end = _target_bounds(key)
+        return version == network.version and start <= last and end >= first
+    match.network = network
+    return match
+
+
+def _index_path(log_path, kind='flags'):
+    return log_path[:-len('.csv')] + '.' + kind
+
+
+def _index_state(index_path):
+    # Return (size, mtime, entries) recorded by the last line of the index without reading all of it
+    try:
+        with open(index_path, 'rb') as index:
+            header = index.readline().decode()
+            end = index.seek(0, os.SEEK_END)
+            index.seek(max(0, end - 4096))
+            last = index.read().splitlines()[-1].decode('utf-8', 'replace')
+    except (OSError, IndexError):
+        return None
+
+    if not header.startswith('#opslog-index;'):
+        return None
+    if last.startswith('+'):
+        fields = last[1:].split(';', 4)
+        return int(fields[2]), int(fields[3]), int(fields[0])
+    fields = header.rstrip('\n').split(';')
+    return int(fields[1]), int(fields[2]), int(fields[3])
+
+
+def _write_index(index_path, size, mtime, entries, postings, bounds=None):
+    # With bounds, a function giving the (version, first, last) addresses of a key, the keys are
+    # written in that order and followed by their bounds records
+    order = sorted(postings, key=bounds) if bounds else list(postings)
+    blocks = list()
+    keys = list()
+    position = 0
+    for key in order:
+        blocks.append((' '.join(['%d:%d' % hit for hit in postings[key]]) + '\n').encode('utf-8'))
+        keys.append('{};{};{};{}\n'.format(key, len(postings[key]), position, len(blocks[-1])).encode('utf-8'))
+        position += len(blocks[-1])
+
+    header = '#opslog-index;{};{};{};{};{}'.format(size, mtime, entries, len(keys), position)
+    records = list()
+    if bounds:
+        header += ';{}'.format(sum(len(line) for line in keys))
+        line_position = 0
+        for key, line in zip(order, keys):
+            records.append(_bounds_record.format(*bounds(key), line_position).encode('utf-8'))
+            line_position += len(line)
+
+    temp_path = index_path + '.tmp{}'.format(os.getpid())
+    with open(temp_path, 'wb') as index:
+        index.write((header + '\n').encode('utf-8'))
+        index.write(b''.join(keys))
+        index.write(b''.join(records))
+        index.write(b''.join(blocks))
+    os.replace(temp_path, index_path)
+
+
+def _read_index(index, match=None):
+    # Read the compacted part of an open index, keeping the keys match() accepts (all keys if None).
+    # Returns ({key: [(entry, offset), ...]}, entry count, offset where the journal starts)
+    header = index.readline().decode('utf-8').rstrip('\n').split(';')
+    entries, keys, length = int(header[3]), int(header[4]), int(header[5])
+    table = index.tell()
+    start = lines = None
+    if len(header) > 6:
+        bounds = table + int(header[6])
+        start = bounds + keys * _bounds_size
+        if getattr(match, 'network', None) is not None:
+            lines = _bisect_bounds(index, bounds, keys, match.network)
+
+    wanted = list()
+    for line in lines if lines is not None else range(keys):
+        if lines is not None:
+            index.seek(table + line)
+        key, _, position, size = index.readline().decode('utf-8', 'replace').rstrip('\n').rsplit(';', 3)
+        if match is None or match(key):
+            wanted.append((key, int(position), int(size)))
+
+    start = start if start is not None else index.tell()
+    postings = dict()
+    for key, position, size in wanted:
+        index.seek(start + position)
+        postings[key] = [tuple(int(n) for n in hit.split(b':')) for hit in index.read(size).split()]
+    return postings, entries, start + length
+
+
+def _scan_index(log, kind, size=None, entries=0):
+    # Read an open log (or segment) from the start, up to offset size, and return the postings of
+    # every key of that kind along with the number of the last entry seen
+    keys = _index_kinds[kind]
+    postings = dict()
+    offset = len(log.readline())
+    while size is None or offset < size:
+        line = log.readline()
+        if not line:
+            break
+        if line.strip():
+            entries += 1
+            for key in keys(_split_entry(line.decode('utf-8', 'replace'))):
+                postings.setdefault(key, []).append((entries, offset))
+        offset += len(line)
+    return postings, entries
+
+
+def _build_index(log_path, kind='flags'):
+    # Scan the whole log once and write a fresh, compacted index
+    with open(log_path, 'rb') as log:
+        stat = os.fstat(log.fileno())
+        postings, entries = _scan_index(log, kind, _intact_end(log_path, stat))
+
+    _write_index(_index_path(log_path, kind), stat.st_size, stat.st_mtime_ns, entries, postings, _index_bounds.get(kind))
+    return postings, entries
+
+
+def _load_index(log_path, kind='flags', match=None):
+    """Return ({key: [(entry, offset), ...]}, entry count) for the log, rebuilding the index if stale.
+
+    Only the postings of the keys match() accepts are read (all keys if match is None). Entry numbers
+    count from the start of the current log file; add _entry_base() to get the numbers shown to the
+    operator.
+    """
+    index_path = _index_path(log_path, kind)
+    stat = os.stat(log_path)
+    state = _index_state(index_path)
+    if state is None or state[:2] != (stat.st_size, stat.st_mtime_ns):
+        postings, entries = _build_index(log_path, kind)
+        return {key: hits for key, hits in postings.items() if match is None or match(key)}, entries
+
+    journal = 0
+    with open(index_path, 'rb') as index:
+        postings, entries, end = _read_index(index, match)
+        index.seek(end)
+        for line in index:
+            journal += 1
+            entry, offset, _, _, keys = line[1:].decode('utf-8', 'replace').rstrip('\n').split(';', 4)
+            entries = int(entry)
+            for key in keys.split():
+                if match is None or match(key):
+                    postings.setdefault(key, []).append((entries, int(offset)))
+
+    # Fold a long journal back into the compacted postings
+    if journal > _index_journal_max and match is None:
+        _write_index(index_path, state[0], state[1], entries, postings, _index_bounds.get(kind))
+    elif journal > _index_journal_max:
+        _load_index(log_path, kind)
+    return postings, entries
+
+
+def _bisect_bounds(index, bounds, keys, network):
+    """Return the positions, within the key table, of the keys of a target index that overlap network.
+
+    bounds is where the records of the keys start. Keys inside network (or starting where it does)
+    are one run of records found by bisecting on the first address. The ones holding it are its
+    supernets, each looked up by its own first address.
+    """
+    def record(n):
+        index.seek(bounds + n * _bounds_size)
+        line = index.read(_bounds_size)
+        return int(line[:1]), int(line[1:40]), int(line[40:79]), int(line[79:99])
+
+    def find(start):
+        # First record at or after (network.version, start)
+        lo, hi = 0, keys
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if record(middle)[:2] < (network.version, start):
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    first, last = int(network[0]), int(network[-1])
+    found = list()
+    n = find(first)
+    while n < keys:
+        version, start, _, position = record(n)
+        if version != network.version or start > last:
+            break
+        found.append(position)
+        n += 1
+
+    for prefix in range(network.prefixlen):
+        supernet = network.supernet(new_prefix=prefix)
+        if int(supernet[0]) == first:
+            continue
+        n = find(int(supernet[0]))
+        while n < keys:
+            version, start, end, position = record(n)
+            if (version, start) != (network.version, int(supernet[0])):
+                break
+            if end == int(supernet[-1]):
+                found.append(position)
+            n += 1
+    return sorted(found)
+
+
+def _index_appended_entries(log_path, before, hits):
+    # Called by the writer while it holds the log lock, right after the entries were written.
+    # hits is a list of (offset, fields) for each new entry and before is the stat of the log taken
+    # just before the write. An index that was already stale is rebuilt.
+    # Returns the entry number of the first new entry.
+    stat = os.stat(log_path)
+    ends = [offset for offset, _ in hits[1:]] + [stat.st_size]
+    first = None
+    for kind, keys in _index_kinds.items():
+        index_path = _index_path(log_path, kind)
+        state = _index_state(index_path)
+        if state is None or state[:2] != (before.st_size, before.st_mtime_ns):
+            first = _build_index(log_path, kind)[1] - len(hits) + 1
+            continue
+        with open(index_path, 'a') as index:
+            index.write(''.join('+{};{};{};{};{}\n'.format(state[2] + n, offset, end, stat.st_mtime_ns,
+                                                         ' '.join(keys(fields)))
+                                for n, ((offset, fields), end) in enumerate(zip(hits, ends), 1)))
+        first = state[2] + 1
+    return first
+
+
+@_timed('index')
+def _index_lookup(log_path, kind, match=None, since=None, until=None, segment_filter=None):
+    """Return {key: [(entry, path, offset), ...]} for every indexed key that match() accepts.
+
+    Hits come from the frozen index of each closed segment, skipping segments outside the time window
+    or rejected by segment_filter(segment), and from the log itself, limited to the window by offset.
+    """
+    found = dict()
+    segments = _load_manifest(log_path)
+    for segment in segments:
+        path, _, _, first_date, last_date, _ = segment
+        if (since and last_date < since) or (until and first_date[:len(until)] > until) \
+                or (segment_filter and not segment_filter(segment)):
+            continue
+        for key, hits in _segment_index(segment, kind, match).items():
+            found.setdefault(key, []).extend((entry, path, offset) for entry, offset in hits)
+
+    start, end, _ = _log_window(log_path, since, until) if since or until else (0, None, 1)
+    base = _entry_base(log_path, segments)
+    for key, hits in _load_index(log_path, kind, match)[0].items():
+        found.setdefault(key, []).extend((base + entry, log_path, offset) for entry, offset in hits
+                                         if offset >= start and (end is None or offset < end))
+    return found
+
+
+@_timed('read')
+def _read_hits(hits, since=None, until=None):
+    # Read the rows of a sorted list of (entry, path, offset) hits, dropping rows outside the time window.
+    # Returns (entries, rows)
+    entries = list()
+    rows = list()
+    for path, group in itertools.groupby(hits, key=lambda hit: hit[1]):
+        group = list(group)
+        for (entry, _, _), row in zip(group, _read_entries_at(path, [offset for _, _, offset in group])):
+            if (not since or row[0] >= since) and (not until or row[0][:len(until)] <= until):
+                entries.append(entry)
+                rows.append(row)
+    return entries, rows
+
+
+@_timed('write')
+def _append_entries(log, log_path, lines):
+    """Append entry lines to an open ('ab') log and keep its indexes up to date.
+
+    The log is locked for the whole write so entries from several writers never interleave.
+    Returns the (entry number, offset) of each new entry.
+    """
+    fcntl.flock(log, fcntl.LOCK_EX)
+    try:
+        # Whatever a crash left at the end of the log goes first. If the log is empty, start it with the proper header
+        offset = _repair_tail(log, log_path) if log.seek(0, os.SEEK_END) else 0
+        if offset == 0:
+            _write_lines(log, (_log_header + "\n").encode('utf-8'))
+            for kind in _index_kinds:
+                _build_index(log_path, kind)
+            _empty_offsets(log_path)
+            _empty_sums(log, log_path)
+            if _durability()[0] == 'always':
+                _sync_dir(log_path)
+            offset = log.seek(0, os.SEEK_END)
+
+        # With segmented storage, close the log into a segment first if it is full
+        if lines and _rotation_due(log_path, offset, lines[0][:10]):
+            offset = _rotate_log(log, log_path)
+
+        before = os.fstat(log.fileno())
+        data = list()
+        hits = list()
+        for line in lines:
+            data.append((line + "\n").encode('utf-8'))
+            hits.append((offset, _split_entry(line)))
+            offset += len(data[-1])
+        _write_lines(log, b''.join(data))
+        _commit_writes(log, log_path, [(offset, line) for (offset, _), line in zip(hits, data)])
+
+        first = _index_appended_entries(log_path, before, hits) + _entry_base(log_path)
+        _offsets_appended(log_path, before, [offset for offset, _ in hits])
+    finally:
+        fcntl.flock(log, fcntl.LOCK_UN)
+
+    return [(first + n, offset) for n, (offset, _) in enumerate(hits)]
+
+
+# Durability
+#
+# 'Fsync' in the [Storage Settings] section of config.ini sets when log writes are forced to disk:
+# 'none' (the default) leaves it to the operating system, 'always' syncs every write before its entry
+# numbers are handed back, and 'batch' syncs once 'Fsync Entries' entries (100 by default) were written
+# since the last sync or 'Fsync Interval' milliseconds (1000) have passed since it, whichever comes
+# first. For the sqlite backend the three set its synchronous pragma to OFF, NORMAL and FULL.
+#
+# Every entry the writer appends also gets an (offset, crc32) record in <operator>_ops_log.sums, after
+# a fixed width '#opslog-sums;inode;synced;time' line naming the log file it belongs to and how many
+# records were synced and when. A crash or a full disk can only damage the end of the log: readers stop
+# before the last entry if it no longer matches its checksum, and the next writer moves such a torn
+# tail, along with any unfinished last line, to <operator>_ops_log.torn before it appends. An earlier
+# entry that no longer matches means the log was edited in place, so nothing is moved and the writer
+# records every checksum again instead. Lines without a record, such as those logged before checksums
+# existed, are trusted.
+_fsync_modes = {'none': 'OFF', 'batch': 'NORMAL', 'always': 'FULL'}
+_sums_state = '#opslog-sums;{:020d};{:020d};{:020d}\n'
+_sums_start = len(_sums_state.format(0, 0, 0))
+_sums_record = struct.Struct('<qI')
+_sums_window = 64
+
+
+def _durability():
+    # Return (mode, entries, milliseconds) of the fsync policy
+    config = _read_config()
+    mode = config.get('Storage Settings', 'Fsync', fallback='none').strip().lower()
+    try:
+        entries = int(config.get('Storage Settings', 'Fsync Entries', fallback='100'))
+        interval = int(config.get('Storage Settings', 'Fsync Interval', fallback='1000'))
+    except ValueError:
+        entries, interval = 100, 1000
+    return mode if mode in _fsync_modes else 'none', max(entries, 1), max(interval, 0)
+
+
+def _sync_dir(path):
+    # Make a file's creation or renaming durable by syncing the directory holding it
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_config(config, path=None):
+    # Replace config.ini in one step: write a temp file beside it, sync it and rename it over the old
+    # one, so a crash or a full disk leaves either the old or the new settings, never an empty file
+    path = path or _configfile
+    temp_path = path + '.tmp{}'.format(os.getpid())
+    try:
+        with open(temp_path, 'w') as cfgfile:
+            config.write(cfgfile)
+            cfgfile.flush()
+            os.fsync(cfgfile.fileno())
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _sync_dir(path)
+
+
+def _sums_path(log_path):
+    return log_path[:-len('.csv')] + '.sums'
+
+
+def _last_sums(sums, inode):
+    # Return (synced, time, records) of an open sums file, where records holds the last _sums_window
+    # (offset, crc) pairs, or None if the file does not belong to the log file with that inode
+    state = os.pread(sums, _sums_start, 0).split(b';')
+    size = os.fstat(sums).st_size
+    if len(state) != 4 or state[0] != b'#opslog-sums' or int(state[1]) != inode \
+            or (size - _sums_start) % _sums_record.size:
+        return None
+    count = (size - _sums_start) // _sums_record.size
+    first = max(count - _sums_window, 0)
+    data = os.pread(sums, (count - first) * _sums_record.size, _sums_start + first * _sums_record.size)
+    return int(state[2]), int(state[3]), list(_sums_record.iter_unpack(data))
+
+
+def _intact_end(log_path, stat):
+    """Return the offset where the undamaged part of the log ends, stat being that of the log"""
+    return _check_sums(log_path, stat)[0]
+
+
+def _check_sums(log_path, stat):
+    """Return (end, stale) for the log, stat being that of the log: where its undamaged part ends, and whether its sums went stale.
+
+    A crash can only tear the last line written, so only the last checksum record that has a line
+    to check can mark it torn, along with any records before it whose line was zeroed. Any other
+    line that no longer matches its checksum means the log was edited in place and the sums are
+    stale: the whole log is then trusted and the next writer records its checksums again. An
+    unfinished last line, one a writer is still writing or a crash cut short, is never part of
+    it, so the end is always just after a newline.
+    """
+    found = None
+    try:
+        sums = os.open(_sums_path(log_path), os.O_RDONLY)
+    except OSError:
+        pass
+    else:
+        try:
+            found = _last_sums(sums, stat.st_ino)
+        finally:
+            os.close(sums)
+
+    end = stat.st_size
+    stale = False
+    log = os.open(log_path, os.O_RDONLY)
+    try:
+        # Lines follow one another, so each one ends where the next record starts. Records past the
+        # end of the log lost their line with it
+        following = stat.st_size
+        checked = 0
+        for offset, crc in reversed(found[2] if found else ()):
+            data = os.pread(log, following - offset, offset) if offset < following else b''
+            following = min(offset, following)
+            if b'\n' not in data:
+                continue
+            line = data[:data.index(b'\n') + 1]
+            if zlib.crc32(line) == crc:
+                break
+            if checked and b'\0' not in line:
+                end, stale = stat.st_size, True
+                break
+            checked += 1
+            end = offset
+
+        while end:
+            block = os.pread(log, min(end, 4096), end - min(end, 4096))
+            if block.endswith(b'\n'):
+                break
+            end -= len(block) - block.rfind(b'\n') - 1
+    finally:
+        os.close(log)
+    return end, stale
+
+
+def _repair_tail(log, log_path):
+    # Called by the writer with the log locked: move a torn tail and any unfinished last line to
+    # <operator>_ops_log.torn so new entries start on a line of their own, and record the checksums
+    # of a log edited in place again. Returns the end of the log
+    stat = os.fstat(log.fileno())
+    end, stale = _check_sums(log_path, stat)
+    if end < stat.st_size:
+        fd = os.open(log_path, os.O_RDONLY)
+        try:
+            torn = os.pread(fd, stat.st_size - end, end)
+        finally:
+            os.close(fd)
+
+        with open(log_path[:-len('.csv')] + '.torn', 'ab') as out:
+            out.write(torn if torn.endswith(b'\n') else torn + b'\n')
+        os.ftruncate(log.fileno(), end)
+
+        # Drop the records of the lines that were moved
+        try:
+            sums = os.open(_sums_path(log_path), os.O_RDWR)
+        except OSError:
+            sums = None
+        if sums is not None:
+            try:
+                size = os.fstat(sums).st_size
+                while size > _sums_start and _sums_record.unpack(os.pread(sums, _sums_record.size, size - _sums_record.size))[0] >= end:
+                    size -= _sums_record.size
+                os.ftruncate(sums, size)
+            finally:
+                os.close(sums)
+        print("Moved {} damaged bytes from the end of {} to {}".format(stat.st_size - end, log_path,
+                                                                      log_path[:-len('.csv')] + '.torn'))
+    if stale:
+        _rebuild_sums(log, log_path, end)
+    return end
+
+
+def _rebuild_sums(log, log_path, end):
+    # Called by the writer with the log locked: replace sums that no longer match the log with a
+    # record for every entry before end
+    lines = _read_lines(log_path, 0, end)
+    next(lines, None)
+    records = (_sums_record.pack(offset, zlib.crc32(line)) for offset, line in lines if line.strip())
+    with open(_sums_path(log_path), 'wb') as sums:
+        sums.write(_sums_state.format(os.fstat(log.fileno()).st_ino, 0, int(time.time() * 1000)).encode('utf-8'))
+        for chunk in iter(lambda: b''.join(itertools.islice(records, 65536)), b''):
+            sums.write(chunk)
+    print("Recorded the checksums of {} again, as it was changed in place".format(log_path))
+
+
+def _empty_sums(log, log_path):
+    # Start the sums of a log that holds nothing but its header, dropping the records of its old lines
+    sums = os.open(_sums_path(log_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        os.write(sums, _sums_state.format(os.fstat(log.fileno()).st_ino, 0, int(time.time() * 1000)).encode('utf-8'))
+    finally:
+        os.close(sums)
+
+
+def _commit_writes(log, log_path, records):
+    # Called by the writer with the log locked once the lines in records, as (offset, line bytes), are
+    # written: add their checksums and sync the log and the sums as the fsync policy asks
+    mode, entries, interval = _durability()
+    inode = os.fstat(log.fileno()).st_ino
+    now = int(time.time() * 1000)
+    sums = os.open(_sums_path(log_path), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        found = _last_sums(sums, inode)
+        if found is None:
+            os.ftruncate(sums, 0)
+            os.pwrite(sums, _sums_state.format(inode, 0, now).encode('utf-8'), 0)
+            synced, last = 0, now
+        else:
+            synced, last, _ = found
+        size = os.fstat(sums).st_size
+        os.pwrite(sums, b''.join(_sums_record.pack(offset, zlib.crc32(line)) for offset, line in records), size)
+
+        count = (size - _sums_start) // _sums_record.size + len(records)
+        if mode == 'always' or (mode == 'batch' and (count - synced >= entries or now - last >= interval)):
+            os.fsync(log.fileno())
+            os.fsync(sums)
+            synced, last = count, now
+        if mode != 'none' or found is None:
+            os.pwrite(sums, _sums_state.format(inode, synced, last).encode('utf-8'), 0)
+    finally:
+        os.close(sums)
+
+
+def _flush_writes(log, log_path):
+    # Sync whatever the writers of a log left unsynced under the batch policy. opslogd calls this once
+    # its clients go quiet, so the last entries of a burst do not wait for the next one
+    fcntl.flock(log, fcntl.LOCK_EX)
+    try:
+        sums = os.open(_sums_path(log_path), os.O_RDWR)
+    except FileNotFoundError:
+        fcntl.flock(log, fcntl.LOCK_UN)
+        return
+    try:
+        inode = os.fstat(log.fileno()).st_ino
+        found = _last_sums(sums, inode)
+        count = (os.fstat(sums).st_size - _sums_start) // _sums_record.size
+        if found and found[0] < count:
+            os.fsync(log.fileno())
+            os.fsync(sums)
+            os.pwrite(sums, _sums_state.format(inode, count, int(time.time() * 1000)).encode('utf-8'), 0)
+    finally:
+        os.close(sums)
+        fcntl.flock(log, fcntl.LOCK_UN)
+
+
+def _write_lines(log, data):
+    # Append data to the log in full, or not at all: if the disk fills up halfway, the part that made it
+    # is cut off again so no half written line is left behind
+    fd = log.fileno()
+    start = os.lseek(fd, 0, os.SEEK_END)
+    view = memoryview(data)
+    try:
+        while view:
+            view = view[os.write(fd, view):]
+    except OSError:
+        os.ftruncate(fd, start)
+        raise
+
+
+# Segmented storage
+#
+# Rotation is optional and set by 'Rotate' in the [Storage Settings] section of config.ini: 'daily',
+# a size such as '10M', or 'none' (the default). When the log is due, its entries are moved to a gzip
+# compressed segment <operator>_ops_log.<n>.csv.gz and the log starts over with just its header.
+# <operator>_ops_log.manifest lists each closed segment with its entry numbers, time range and flags
+# so readers can skip segments that cannot match, and the segment's indexes are kept beside it as
+# <operator>_ops_log.<n>.<kind>. Entry numbers run on across segments.
+_manifest_header = 'Segment;First Entry;Last Entry;First Date;Last Date;Flags'
+
+
+def _rotation():
+    # Return 'daily', a size in bytes, or None when rotation is off
+    value = _read_config().get('Storage Settings', 'Rotate', fallback='none').strip().lower()
+    match = re.match(r"^(\d+)\s*([kmg]?)b?$", value)
+    if value == 'daily':
+        return value
+    elif match:
+        return int(match.group(1)) * 1024 ** ' kmg'.index(match.group(2) or ' ')
+    return None
+
+
+def _manifest_path(log_path):
+    return log_path[:-len('.csv')] + '.manifest'
+
+
+def _load_manifest(log_path):
+    """Return [(segment path, first entry, last entry, first date, last date, flags), ...] for every closed segment"""
+    segments = list()
+    try:
+        with open(_manifest_path(log_path)) as manifest:
+            manifest.readline()
+            for line in manifest:
+                name, first, last, first_date, last_date, flags = line.rstrip('\n').split(';', 5)
+                segments.append((os.path.join(os.path.dirname(log_path), name), int(first), int(last),
+                                 first_date, last_date, set(flags.split())))
+    except FileNotFoundError:
+        pass
+    return segments
+
+
+def _entry_base(log_path, segments=None):
+    # Number of entries held in closed segments, which is where the current log's numbering starts
+    segments = _load_manifest(log_path) if segments is None else segments
+    return segments[-1][2] if segments else 0
+
+
+def _segment_index_path(segment, kind='flags'):
+    return segment[:-len('.csv.gz')] + '.' + kind
+
+
+def _segment_index(segment, kind='flags', match=None):
+    # Read the frozen index of a closed segment, keeping the keys match() accepts. Segments closed
+    # before an index kind existed get that index built the first time it is needed.
+    path = segment[0]
+    try:
+        with open(_segment_index_path(path, kind), 'rb') as index:
+            return _read_index(index, match)[0]
+    except FileNotFoundError:
+        with gzip.open(path, 'rb') as log:
+            postings, entries = _scan_index(log, kind, entries=segment[1] - 1)
+        _write_index(_segment_index_path(path, kind), 0, 0, entries, postings, _index_bounds.get(kind))
+        return {key: hits for key, hits in postings.items() if match is None or match(key)}
+
+
+def _rotation_due(log_path, size, date):
+    # Decide whether the log (currently size bytes) must be closed before an entry dated date is added
+    rotation = _rotation()
+    if rotation is None:
+        return False
+    with open(log_path, 'rb') as log:
+        header = len(log.readline())
+        first_date = log.readline()[:10].decode('utf-8', 'replace')
+    if size <= header:
+        return False
+    return first_date != date if rotation == 'daily' else size >= rotation
+
+
+def _rotate_log(log, log_path):
+    # Close the current log into a compressed segment and start it over. Called with the log locked.
+    # Returns the new end of the log
+    segments = _load_manifest(log_path)
+    base = _entry_base(log_path, segments)
+    indexes = {kind: _load_index(log_path, kind) for kind in _index_kinds}
+    postings, entries = indexes['flags']
+    segment = log_path[:-len('.csv')] + '.{}.csv.gz'.format(len(segments) + 1)
+
+    first_date = last_date = ''
+    with open(log_path, 'rb') as current, gzip.open(segment + '.tmp', 'wb') as closed:
+        header = current.readline()
+        closed.write(header)
+        for line in current:
+            if line.strip():
+                last_date = line[:19].decode('utf-8', 'replace')
+                first_date = first_date or last_date
+            closed.write(line)
+    if _durability()[0] != 'none':
+        with open(segment + '.tmp', 'rb') as closed:
+            os.fsync(closed.fileno())
+    os.replace(segment + '.tmp', segment)
+
+    for kind, (kind_postings, _) in indexes.items():
+        _write_index(_segment_index_path(segment, kind), 0, 0, base + entries,
+                     {key: [(base + entry, offset) for entry, offset in hits] for key, hits in kind_postings.items()},
+                     _index_bounds.get(kind))
+    with open(_manifest_path(log_path), 'a') as manifest:
+        if manifest.tell() == 0:
+            manifest.write(_manifest_header + "\n")
+        manifest.write('{};{};{};{};{};{}\n'.format(os.path.basename(segment), base + 1, base + entries,
+                                                    first_date, last_date, ' '.join(sorted(postings))))
+
+    if _durability()[0] != 'none':
+        _sync_dir(segment)
+    os.ftruncate(log.fileno(), len(header))
+    for kind in _index_kinds:
+        _build_index(log_path, kind)
+    _empty_offsets(log_path)
+    _empty_sums(log, log_path)
+    return log.seek(0, os.SEEK_END)
+
+
+# SQLite storage
+#
+# Setting 'Backend = sqlite' in the [Storage Settings] section of config.ini keeps each operator's
+# entries in <operator>_ops_log.db instead of the csv log. The database runs in WAL mode, so readers
+# never wait on a writer and shells logging at the same time queue for the write lock for up to
+# _db_timeout seconds. The entries table has one column per log field, the entry number as its rowid
+# and indexes on date, operator and PAA. The flags table holds one row per flag of each entry, keyed
+# by flag, so -sf and -lf are index lookups. Command outcomes go to the outcomes table. Fields are
+# stored as they are, so a ';' in a note or command cannot break the row. 'opslog --import FILE' loads
+# a csv log into the database and '--export FILE --format csv' writes one back out. Rotation, the
+# sidecar indexes and caches, --incremental and opslogd only apply to csv logs.
+_db_timeout = 30
+_db_columns = 'date, operator, flag, paa, ips, command, executed, note'
+_db_schema = """
+CREATE TABLE IF NOT EXISTS entries (entry INTEGER PRIMARY KEY, date TEXT, operator TEXT, flag TEXT, paa TEXT,
+                                    ips TEXT, command TEXT, executed TEXT, note TEXT);
+CREATE INDEX IF NOT EXISTS entries_date ON entries (date);
+CREATE INDEX IF NOT EXISTS entries_operator ON entries (operator);
+CREATE INDEX IF NOT EXISTS entries_paa ON entries (paa);
+CREATE TABLE IF NOT EXISTS flags (flag TEXT, entry INTEGER, PRIMARY KEY (flag, entry)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS outcomes (entry INTEGER PRIMARY KEY, exit_code INTEGER, started TEXT, finished TEXT,
+                                     duration TEXT, error TEXT);
+"""
+
+
+def _backend():
+    # Return 'sqlite' or 'csv' (the default)
+    value = _read_config().get('Storage Settings', 'Backend', fallback='csv').strip().lower()
+    return 'sqlite' if value == 'sqlite' else 'csv'
+
+
+def _db_path(log_path):
+    return log_path[:-len('.csv')] + '.db'
+
+
+def _db_connect(log_path, create=False):
+    # Open the database kept in place of a log. A missing one raises FileNotFoundError, as a missing log
+    # would, unless create is set
+    import sqlite3
+    path = _db_path(log_path)
+    if not create and not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    db = sqlite3.connect(path, timeout=_db_timeout, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    if _read_config().has_option('Storage Settings', 'Fsync'):
+        db.execute('PRAGMA synchronous={}'.format(_fsync_modes[_durability()[0]]))
+    db.executescript(_db_schema)
+    return db
+
+
+def _db_append(log_path, rows):
+    # Add entries, each a list of the 8 log fields, in one transaction and return their entry numbers
+    db = _db_connect(log_path, create=True)
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        entries = list()
+        for fields in rows:
+            entry = db.execute('INSERT INTO entries ({}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(_db_columns),
+                               fields).lastrowid
+            db.executemany('INSERT OR IGNORE INTO flags VALUES (?, ?)', [(flag, entry) for flag in set(fields[2].split())])
+            entries.append(entry)
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    return entries
+
+
+def _db_merge(log_path, rows):
+    """Add entries, each a list of the 8 log fields and sorted by date, merged by date into those already there.
+
+    Entries dated after the first of rows are renumbered to make room for the ones going before
+    them, in one transaction, and their flags and outcomes move with them. On the same date the
+    entries already there come first. Returns (entry numbers of rows, how many were renumbered).
+    """
+    db = _db_connect(log_path, create=True)
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        start = db.execute('SELECT min(entry) FROM entries WHERE date > ?', (rows[0][0],)).fetchone()[0]
+        later = list()
+        outcomes = list()
+        if start is None:
+            start = (db.execute('SELECT max(entry) FROM entries').fetchone()[0] or 0) + 1
+        else:
+            later = db.execute('SELECT entry, {} FROM entries WHERE entry >= ? ORDER BY entry'.format(_db_columns),
+                               (start,)).fetchall()
+            outcomes = db.execute('SELECT * FROM outcomes WHERE entry >= ?', (start,)).fetchall()
+            for table in ('entries', 'flags', 'outcomes'):
+                db.execute('DELETE FROM {} WHERE entry >= ?'.format(table), (start,))
+
+        entries = list()
+        numbers = dict()
+        merged = heapq.merge(((list(fields), old) for old, *fields in later), ((fields, None) for fields in rows),
+                             key=lambda row: row[0][0])
+        for entry, (fields, old) in enumerate(merged, start):
+            db.execute('INSERT INTO entries (entry, {}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'.format(_db_columns),
+                       [entry] + fields)
+            db.executemany('INSERT OR IGNORE INTO flags VALUES (?, ?)', [(flag, entry) for flag in set(fields[2].split())])
+            if old is None:
+                entries.append(entry)
+            else:
+                numbers[old] = entry
+        db.executemany('INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?)',
+                       [(numbers[outcome[0]],) + tuple(outcome[1:]) for outcome in outcomes if outcome[0] in numbers])
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    return entries, len(later)
+
+
+def _db_outcomes(db, entries=None):
+    # Same as _load_outcomes(), read from the outcomes table, or only those of the given entries.
+    # Entries have no byte offset here
+    if entries is None:
+        return {row[0]: (0,) + row[1:] for row in db.execute('SELECT * FROM outcomes')}
+    return {row[0]: (0,) + row[1:] for row in db.execute('SELECT * FROM outcomes WHERE entry IN (SELECT value FROM json_each(?))',
+                                                         (json.dumps(list(entries)),))}
+
+
+def _db_rows(log_path, since=None, until=None, flags=None, terms=None, targets=None, head=None, tail=None,
+             joined=True, entries=None):
+    """Return a generator of (entry number, fields) for the entries of a log's database, oldest first.
+
+    Entries can be limited to a time window, to those tagged with any of flags, to those whose note
+    or command syntax contains every one of terms (lower case), to those with a target that
+    targets(network) accepts and to the (first, last) range of entry numbers entries. head and tail
+    keep only the first or last entries. Command outcomes are joined on unless joined is false.
+    """
+    db = _db_connect(log_path)
+    clauses = list()
+    params = list()
+    if entries:
+        clauses.append('entry BETWEEN ? AND ?')
+        params.extend(entries)
+    if since:
+        clauses.append('date >= ?')
+        params.append(since)
+    if until:
+        # Every date starting with until sorts below until followed by DEL
+        clauses.append('date < ?')
+        params.append(until + '\x7f')
+    if flags:
+        clauses.append('entry IN (SELECT entry FROM flags WHERE flag IN ({}))'.format(', '.join('?' * len(flags))))
+        params.extend(flags)
+    for term in terms or ():
+        clauses.append('(instr(lower(command), ?) OR instr(lower(note), ?))')
+        params.extend([term, term])
+    if targets:
+        db.create_function('targets', 1, functools.lru_cache(maxsize=1 << 16)(
+            lambda ips: any(targets(key) for key in _targets(ips))), deterministic=True)
+        clauses.append('targets(ips)')
+
+    query = 'SELECT entry, {} FROM entries'.format(_db_columns)
+    query += ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    query += ' ORDER BY entry DESC' if tail is not None else ' ORDER BY entry'
+    if head is not None or tail is not None:
+        query += ' LIMIT ?'
+        params.append(max(head if head is not None else tail, 0))
+    outcomes = _db_outcomes(db) if joined else dict()
+    cursor = db.execute(query, params)
+
+    def rows():
+        try:
+            for entry, *fields in (reversed(cursor.fetchall()) if tail is not None else cursor):
+                if entry in outcomes:
+                    fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                yield entry, fields
+        finally:
+            db.close()
+    return rows()
+
+
+def _db_log(log_path, since=None, until=None, **limits):
+    # Load the entries _db_rows() returns into the table _get_log() would produce
+    entries = list()
+    rows = list()
+    for entry, fields in _db_rows(log_path, since, until, **limits):
+        entries.append(entry)
+        rows.append(fields)
+    return _entry_frame(entries, rows)
+
+
+def _db_lines(log_path, since=None, until=None, **limits):
+    # (entry number, raw line) pairs like _log_lines() yields, read from a log's database
+    return ((entry, (';'.join(fields) + "\n").encode('utf-8'))
+            for entry, fields in _db_rows(log_path, since, until, **limits))
+
+
+def _db_stats(log_path, since=None, until=None):
+    # Same counts as _log_stats(), worked out by the database
+    db = _db_connect(log_path)
+    try:
+        window = 'FROM entries WHERE date >= ? AND date < ?'
+        params = (since or '', (until or '9999') + '\x7f')
+        stats = collections.defaultdict(collections.Counter)
+
+        def count(name, expression):
+            stats[name].update(dict(db.execute('SELECT {0}, count(*) {1} GROUP BY {0}'.format(expression, window), params)))
+
+        count('paa', 'paa')
+        count('executed', 'executed')
+        count('days', 'substr(date, 1, 10)')
+        count('hours', 'CAST(substr(date, 12, 2) AS INTEGER)')
+        stats['entries'][''] = sum(stats['days'].values())
+        stats['flags'].update(dict(db.execute(
+            'SELECT flag, count(*) FROM flags WHERE entry IN (SELECT entry {}) GROUP BY flag'.format(window), params)))
+        for ips, number in db.execute('SELECT ips, count(*) {} GROUP BY ips'.format(window), params):
+            for target in ips.replace(',', ' ').split():
+                stats['targets'][target] += number
+        stats['failed'][''] = db.execute('SELECT count(*) FROM outcomes WHERE exit_code != 0 AND entry IN '
+                                         '(SELECT entry {})'.format(window), params).fetchone()[0]
+        legacy = db.execute("SELECT count(*) {} AND executed = 'no' AND instr(note, ?) AND entry NOT IN "
+                            "(SELECT entry FROM outcomes)".format(window), params + (_legacy_error,)).fetchone()[0]
+        _legacy_failures(stats, legacy)
+    finally:
+        db.close()
+    return stats
+
+
+def _import_log(source):
+    """Load the entries of a csv log, and the command outcomes recorded beside it, into the current operator's database"""
+    if _backend() != 'sqlite':
+        print("--import loads a csv log into the sqlite backend, set 'Backend = sqlite' under [Storage Settings] first")
+        sys.exit(1)
+    try:
+        with open(source, 'rb') as log:
+            if not log.readline().startswith(b'Date;'):
+                print("{} is not an opslog csv log".format(source))
+                sys.exit(1)
+        numbers = dict()
+        rows = list()
+        for entry, line in _log_lines(source):
+            numbers[entry] = len(rows)
+            rows.append(_split_entry(line.decode('utf-8', 'replace')))
+    except FileNotFoundError:
+        print("No such file: {}".format(source))
+        sys.exit(1)
+    if not rows:
+        print("No entries to import.")
+        return
+
+    # Entries are kept in date order, so the source goes in sorted, in log order on the same date, and
+    # is merged by date into the entries already there. Entries already in the database, as after
+    # importing the same log twice, are skipped
+    log_path = _log_path()
+    order = sorted(range(len(rows)), key=lambda n: rows[n][0])
+    present = collections.Counter()
+    try:
+        db = _db_connect(log_path)
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            present.update(db.execute('SELECT {} FROM entries WHERE date >= ?'.format(_db_columns), (rows[order[0]][0],)))
+        finally:
+            db.close()
+    new = list()
+    for n in order:
+        if present[tuple(rows[n])]:
+            present[tuple(rows[n])] -= 1
+        else:
+            new.append(n)
+
+    if not new:
+        print("All {} entries of {} are already in the database.".format(len(rows), source))
+        return
+
+    entries, moved = _db_merge(log_path, [rows[n] for n in new])
+    imported = {n: entry for n, entry in zip(new, entries)}
+    outcomes = [(imported[numbers[entry]],) + outcome[1:] for entry, outcome in _load_outcomes(source).items()
+                if entry in numbers and numbers[entry] in imported]
+    db = _db_connect(log_path)
+    try:
+        db.executemany('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?, ?)', outcomes)
+    finally:
+        db.close()
+    skipped = " ({} already in the database skipped)".format(len(rows) - len(new)) if len(new) < len(rows) else ""
+    print("Imported {} entries ({}-{}){}".format(len(entries), entries[0], entries[-1], skipped))
+    if moved:
+        print("The {} entries dated after {} were renumbered to keep the log in date order".format(moved, rows[new[0]][0]))
+
+
+# Parse cache
+#
+# <operator>_ops_log.cache, and <operator>_ops_log.<n>.cache for each closed segment, holds the log
+# already split into columns so --cat and default exports do not have to parse the csv. The first
+# line records the log size, mtime and inode the cache was built at, the number of rows and a
+# checksum of the last _cache_tail bytes parsed. The second is the log header and the third the byte length of
+# each column. Each column then follows as an int64 array of rows + 1 value offsets and the values
+# themselves, each ending in a newline, so the file can be memory mapped and any run of rows sliced
+# out of a column without decoding the rest. A log that only grew since (same inode, same bytes at
+# the end of the parsed part) is extended by parsing just the new bytes; anything else rebuilds it. If the cache cannot be written it is kept in memory.
+_cache_tail = 64
+
+
+def _cache_path(path):
+    return _segment_index_path(path, 'cache') if path.endswith('.gz') else _index_path(path, 'cache')
+
+
+def _parse_cache(buffer):
+    # Return (size, mtime, inode, rows, tail, header, columns) from a cache held in buffer (bytes or mmap),
+    # where columns is a list of (value offsets, start of values) for each header field
+    import numpy
+    first = buffer.find(b'\n') + 1
+    second = buffer.find(b'\n', first) + 1
+    third = buffer.find(b'\n', second) + 1
+    state = buffer[:first].decode('utf-8').rstrip('\n').split(';')
+    if state[0] != '#opslog-cache':
+        raise ValueError('not an opslog cache')
+    size, mtime, inode, rows, tail = (int(value) for value in state[1:6])
+
+    columns = list()
+    position = third
+    for length in buffer[second:third].split(b';'):
+        offsets = numpy.frombuffer(buffer, '<i8', rows + 1, position)
+        position += offsets.nbytes
+        columns.append((offsets, position))
+        position += int(length)
+    return size, mtime, inode, rows, tail, buffer[first:second].decode('utf-8').rstrip('\r\n').split(';'), columns
+
+
+def _cache_bytes(state, header, offsets, values):
+    # Lay out a cache: the state line, the log header, the column lengths, then every column
+    lines = ['#opslog-cache;{};{};{};{};{}\n'.format(*state).encode('utf-8'), header,
+             (';'.join(str(len(column)) for column in values) + "\n").encode('utf-8')]
+    for column_offsets, column in zip(offsets, values):
+        lines.append(column_offsets.astype('<i8').tobytes())
+        lines.append(column)
+    return b''.join(lines)
+
+
+@_timed('parse')
+def _update_cache(path):
+    # Bring the cache of a log or closed segment up to date and return (parsed cache, buffer)
+    import numpy
+    cache_path = _cache_path(path)
+    stat = os.stat(path)
+    buffer = cached = None
+    try:
+        with open(cache_path, 'rb') as cache:
+            buffer = mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ)
+        cached = _parse_cache(buffer)
+    except (OSError, ValueError):
+        pass
+    if cached and cached[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+        return cached, buffer
+
+    # A log that only had entries appended still ends its parsed part with the same bytes.
+    # Closed segments never change, so theirs is simply rebuilt
+    start = 0
+    with _open_log(path) as log:
+        header = log.readline()
+        if cached and not path.endswith('.gz') and cached[2] == stat.st_ino and len(header) <= cached[0] <= stat.st_size:
+            log.seek(cached[0] - min(_cache_tail, cached[0]))
+            if zlib.crc32(log.read(min(_cache_tail, cached[0]))) == cached[4]:
+                start = cached[0]
+        log.seek(start or len(header))
+        data = log.read()
+        if not path.endswith('.gz'):
+            data = data[:max(_intact_end(path, stat) - (start or len(header)), 0)]
+
+    # Only whole lines are parsed, a line still being written is left for the next update
+    data = data[:data.rfind(b'\n') + 1]
+    fields = len(_split_entry(''))
+    parsed = [list() for _ in range(fields)]
+    for line in data.decode('utf-8', 'replace').split('\n'):
+        if line.strip():
+            for column, value in zip(parsed, _split_entry(line)):
+                column.append(value)
+    values = [(''.join(value + '\n' for value in column)).encode('utf-8') for column in parsed]
+    offsets = [numpy.concatenate(([0], numpy.flatnonzero(numpy.frombuffer(column, 'u1') == 10) + 1))
+               for column in values]
+    rows = len(parsed[0])
+
+    # Put the new rows after the ones already cached
+    if start:
+        rows += cached[3]
+        for n, (old_offsets, position) in enumerate(cached[6]):
+            values[n] = buffer[position:position + int(old_offsets[-1])] + values[n]
+            offsets[n] = numpy.concatenate((old_offsets, offsets[n][1:] + old_offsets[-1]))
+
+    if path.endswith('.gz'):
+        state = (stat.st_size, stat.st_mtime_ns, stat.st_ino, rows, 0)
+    else:
+        size = (start or len(header)) + len(data)
+        with open(path, 'rb') as log:
+            log.seek(size - min(_cache_tail, size))
+            tail = zlib.crc32(log.read(min(_cache_tail, size)))
+        state = (size, stat.st_mtime_ns if size == stat.st_size else 0, stat.st_ino, rows, tail)
+
+    data = _cache_bytes(state, header, offsets, values)
+    try:
+        temp_path = cache_path + '.tmp{}'.format(os.getpid())
+        with open(temp_path, 'wb') as cache:
+            cache.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+    return _parse_cache(data), data
+
+
+def _cache_range(cache, buffer, since=None, until=None):
+    # Rows [lo, hi) of a parsed cache dated between since and until (every row if neither is given).
+    # Rows are in date order, so both ends are found by bisecting the Date column
+    rows = cache[3]
+    offsets, position = cache[6][0]
+
+    def bisect(lo, past):
+        hi = rows
+        while lo < hi:
+            middle = (lo + hi) // 2
+            start = position + int(offsets[middle])
+            if past(buffer[start:start + 19]):
+                hi = middle
+            else:
+                lo = middle + 1
+        return lo
+
+    lo = bisect(0, lambda date: date >= since.encode()) if since else 0
+    hi = bisect(lo, lambda date: date[:len(until)] > until.encode()) if until else rows
+    return lo, hi
+
+
+def _cache_slice(cache, buffer, lo, hi):
+    # Decode rows [lo, hi) of a parsed cache into one list of values per column
+    values = list()
+    for offsets, position in cache[6]:
+        text = buffer[position + int(offsets[lo]):position + int(offsets[hi])].decode('utf-8', 'replace')
+        values.append(text.split('\n')[:-1])
+    return values
+
+
+def _cache_widths(cache, lo, hi):
+    # Longest value of each column in rows [lo, hi), in bytes, straight from the value offsets
+    if hi <= lo:
+        return [0] * len(cache[6])
+    return [int((offsets[lo + 1:hi + 1] - offsets[lo:hi]).max()) - 1 for offsets, _ in cache[6]]
+
+
+def _cached_columns(path, since=None, until=None):
+    """Return (header fields, columns, first row) for a log or closed segment, read from its cache.
+
+    columns holds one list of values per header field for the rows dated between since and until
+    (every row if neither is given). first is the number of the first of those rows within path,
+    counting from 1.
+    """
+    cache, buffer = _update_cache(path)
+    lo, hi = _cache_range(cache, buffer, since, until)
+    return cache[5], _cache_slice(cache, buffer, lo, hi), lo + 1
+
+
+# Command outcome sidecar
+#
+# <operator>_ops_log.results holds one 'entry;offset;exit code;started;finished;duration;error' line
+# per command run with -C (older files may also hold 'entry;offset;exit code;finished;error' lines).
+# The log itself is never rewritten: readers join each outcome onto the entry it belongs to.
+_results_header = 'Entry;Offset;Exit Code;Started;Finished;Duration;Error'
+# Before that, a failed command had its entry rewritten to Executed 'no' with this and the error added to the note
+_legacy_error = ' - ERROR:'
+
+
+def _results_path(log_path):
+    return log_path[:-len('.csv')] + '.results'
+
+
+def _record_outcome(log_path, entry, offset, exit_code, error, started='', duration=''):
+    _record_outcomes(log_path, [(entry, offset, exit_code, error, started, duration)])
+
+
+def _record_outcomes(log_path, outcomes):
+    # Record (entry, offset, exit code, error, started, duration) outcomes with one locked write
+    finished = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    # The error ends up in the Note column of exports, so it must stay on one line and free of ';'
+    outcomes = [(entry, offset, exit_code, ' '.join(error.split()).replace(';', ','), started, duration)
+                for entry, offset, exit_code, error, started, duration in outcomes]
+    if _backend() == 'sqlite':
+        db = _db_connect(log_path)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?, ?)',
+                           [(entry, exit_code, started, finished, duration, error)
+                            for entry, _, exit_code, error, started, duration in outcomes])
+            db.execute('COMMIT')
+        finally:
+            db.close()
+        return
+    with open(_results_path(log_path), 'a') as results:
+        fcntl.flock(results, fcntl.LOCK_EX)
+        if results.tell() == 0:
+            results.write(_results_header + "\n")
+        results.writelines('{};{};{};{};{};{};{}\n'.format(entry, offset, exit_code, started, finished, duration, error)
+                           for entry, offset, exit_code, error, started, duration in outcomes)
+        if _durability()[0] == 'always':
+            results.flush()
+            os.fsync(results.fileno())
+
+
+def _load_outcomes(log_path):
+    """Return {entry: (offset, exit code, started, finished, duration, error)} for every command outcome of the log"""
+    outcomes = dict()
+    try:
+        with open(_results_path(log_path)) as results:
+            results.readline()
+            for line in results:
+                fields = line.rstrip('\n').split(';')
+                if len(fields) == 7:
+                    outcomes[int(fields[0])] = (int(fields[1]), int(fields[2])) + tuple(fields[3:])
+                elif len(fields) == 5:
+                    outcomes[int(fields[0])] = (int(fields[1]), int(fields[2]), '', fields[3], '', fields[4])
+    except FileNotFoundError:
+        pass
+    return _matching_outcomes(log_path, outcomes) if outcomes else outcomes
+
+
+def _matching_outcomes(log_path, outcomes):
+    # Drop the outcomes whose entry no longer starts at the offset recorded with them, as after the log
+    # was edited in place. Rotation copies the log into its segment as is, so the offsets still hold there
+    segments = _load_manifest(log_path)
+    parts = [(segment[0], segment[1]) for segment in segments] + [(log_path, _entry_base(log_path, segments) + 1)]
+    offsets = dict()
+    for entry in sorted(outcomes):
+        path, first = next((part for part in reversed(parts) if part[1] <= entry), (None, 0))
+        if path not in offsets:
+            try:
+                offsets[path] = _entry_offsets(path) if path else ()
+            except OSError:
+                offsets[path] = ()
+        if entry - first >= len(offsets[path]) or offsets[path][entry - first] != outcomes[entry][0]:
+            del outcomes[entry]
+    return outcomes
+
+
+def _joined_rows(entries, rows, outcomes):
+    # (entry, fields) for the entries and their rows with outcomes joined on, as _apply_outcomes() does for a table
+    for entry, fields in zip(entries, rows):
+        if entry in outcomes:
+            fields = list(fields)
+            fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+        yield entry, fields
+
+
+def _outcome_fields(executed, note, outcome):
+    # Return the Executed and Note values an entry shows once its command outcome is joined on
+    _, exit_code, _, finished, duration, error = outcome
+    ran = ', ran {}s'.format(duration) if duration else ''
+    if exit_code == 0:
+        return executed, '{} - (exit 0 at {}{})'.format(note, finished, ran) if duration else note
+    return 'no', '{} - ERROR: {} (exit {} at {}{})'.format(note, error, exit_code, finished, ran)
+
+
+def _apply_outcomes(log, outcomes, base=1):
+    # Join outcomes onto a log table whose first entry has the index base
+    for entry, outcome in outcomes.items():
+        index = entry - 1 + base
+        if index in log.index:
+            log.at[index, 'Executed'], log.at[index, 'Note'] = _outcome_fields(
+                str(log.at[index, 'Executed']), str(log.at[index, 'Note']), outcome)
+    return log
+
+
+@_timed('render')
 def display_log(log=None):
 
     if isinstance(log, type(None)):
@@ -278,21 +2021,210 @@ def display_log(log=None):
     sys.exit()
 
 
-def list_flags():
+# Streaming table output
+#
+# --cat, -sf, --grep and --target write their table a chunk of _table_chunk rows at a time instead
+# of rendering it whole. Column widths come from the parse cache when the rows are read from it,
+# otherwise from the first _width_rows rows; a later row that is longer just pushes its line out.
+# The note is the last column and is never padded, so command outcomes joined on do not change the
+# widths. --head and --tail work out which rows to read before reading any of them.
+_table_chunk = 1000
+_width_rows = 1000
+
+
+def _table_widths(rows):
+    # Return (entry width, column widths, rows) from a bounded first pass over rows, which are
+    # (entry, fields) pairs. The rows returned still include the ones looked at
+    rows = iter(rows)
+    first = list(itertools.islice(rows, _width_rows))
+    widths = [0] * len(_log_header.split(';'))
+    entry_width = 0
+    for entry, fields in first:
+        entry_width = max(entry_width, len(str(entry)))
+        widths = [max(width, len(value)) for width, value in zip(widths, fields)]
+    return entry_width, widths, itertools.chain(first, rows)
+
+
+def _write_table(rows, entry_width, widths, out, header=True):
+    # Write the header (unless told not to) and then every (entry, fields) row, one chunk of lines at a time
+    names = _log_header.split(';')
+    widths = [max(width, len(name)) for width, name in zip(widths, names)]
+    pad = [width + 2 for width in widths[:-1]]
+
+    def line(entry, fields):
+        cells = [value.ljust(width) for value, width in zip(fields, pad)]
+        return (entry.rjust(entry_width) + '  ' + ''.join(cells) + fields[-1]).rstrip() + "\n"
+
+    if header:
+        out.write(line('', names))
+    rows = iter(rows)
+    while True:
+        chunk = [line(str(entry), fields) for entry, fields in itertools.islice(rows, _table_chunk)]
+        if not chunk:
+            break
+        out.write(''.join(chunk))
+
+
+@_timed('render')
+def show_log(rows, widths=None, empty=None):
+    """Write (entry, fields) rows to stdout as a table, streaming them as they are produced.
+
+    widths is (entry width, column widths) when already known. If there are no rows, empty is
+    printed instead (the flag search message by default). Exits quietly once stdout is closed,
+    e.g. when piped to head.
+    """
+    entry_width, widths, rows = _table_widths(rows) if widths is None else widths + (iter(rows),)
+    first = next(rows, None)
+    try:
+        if first is None:
+            print(empty or "\nThere are no entries in current log tagged with any of the provided flags.\n"
+                           "Use 'opslog -lf' to list all currently used flags\n")
+            return
+        sys.stdout.write("\n")
+        _write_table(itertools.chain([first], rows), entry_width, widths, sys.stdout)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        _stdout_closed()
+
+
+def show_report(text):
+    """Write a report such as that of --stats to stdout, exiting quietly once stdout is closed"""
+    try:
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        _stdout_closed()
+
+
+def _stdout_closed():
+    # Nobody is reading any more. Point stdout at devnull so the flush at exit does not fail again
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    sys.exit(0)
+
+
+def _limit_rows(rows, head=None, tail=None):
+    # Keep the first head or the last tail of the rows
+    if head is not None:
+        return itertools.islice(rows, max(head, 0))
+    if tail is not None:
+        return iter(collections.deque(rows, max(tail, 0)))
+    return rows
+
+
+def _cat_rows(since=None, until=None, head=None, tail=None, all_operators=False):
+    """Return (rows, widths, empty) for --cat, where rows yields (entry, fields) for every entry shown.
+
+    The current operator's log is read from the parse caches of the log and its closed segments.
+    Their row counts decide which rows --head or --tail keep, so only those are decoded, and the
+    widths (None for --all-operators) come from the cached value offsets of just those rows. empty
+    is the message to show if there are none.
+    """
+    window = " logged between {} and {}".format(since, until) if since and until \
+        else " logged at or after {}".format(since) if since \
+        else " logged up to {}".format(until) if until else ""
+    empty = "\nThere are no entries{} in the {}.\n".format(
+        window, "logs of every operator" if all_operators else "current log")
+    if all_operators:
+        lines = _all_operator_lines(since=since, until=until)
+        rows = ((entry, _split_entry(line.decode('utf-8', 'replace'))) for entry, line in lines)
+        return _limit_rows(rows, head, tail), None, empty
 
-    log = _get_log()
+    try:
+        log_path = _log_path()
+        if _backend() == 'sqlite':
+            return _db_rows(log_path, since, until, head=head, tail=tail), None, empty
+        parts = list()
+        for path, first in _log_parts(log_path, since, until):
+            cache, buffer = _update_cache(path)
+            parts.append([first, cache, buffer, *_cache_range(cache, buffer, since, until)])
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
 
-    # Creates a set which contains all the unique flags found in entries
-    # This is created using nested list comprehensions.
-    # the first comprehension creates a list of flag entries, the second takes that
-    # list and creates a list of all individual flags from those entries.
-    # this is required because the first comprehension can create a list of lists
-    # if multiple flags are used in a single entry.
-    flags = set([flag2 for i in range(len([flag.split() for flag in log['Flag']]))
-                 for flag2 in [flag.split() for flag in log['Flag']][i]])
+    # Narrow each part's [lo, hi) down to the rows kept
+    skip = max(sum(hi - lo for *_, lo, hi in parts) - tail, 0) if tail is not None else 0
+    keep = max(head, 0) if head is not None else None
+    for part in parts:
+        lo, hi = part[3:]
+        lo += min(skip, hi - lo)
+        skip -= lo - part[3]
+        if keep is not None:
+            hi = min(hi, lo + keep)
+            keep -= hi - lo
+        part[3:] = lo, hi
+    parts = [part for part in parts if part[4] > part[3]]
+
+    widths = [0] * len(_log_header.split(';'))
+    for _, cache, _, lo, hi in parts:
+        widths = [max(width, new) for width, new in zip(widths, _cache_widths(cache, lo, hi))]
+    entry_width = len(str(parts[-1][0] + parts[-1][4] - 1)) if parts else 0
+    outcomes = _load_outcomes(log_path)
+
+    def rows():
+        for first, cache, buffer, lo, hi in parts:
+            for start in range(lo, hi, _table_chunk):
+                columns = _cache_slice(cache, buffer, start, min(start + _table_chunk, hi))
+                for entry, fields in enumerate(zip(*columns), first + start):
+                    fields = list(fields)
+                    if entry in outcomes:
+                        fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                    yield entry, fields
+
+    return rows(), (entry_width, widths), empty
+
+
+def _show_rows(first, last):
+    """Return (rows, widths, empty) for --show, where rows yields (entry, fields) for the entries numbered first to last.
+
+    The closed segments holding none of them are skipped using the entry numbers in the manifest. In
+    the others and in the current log, the offsets file gives where the first entry asked for starts,
+    so nothing before it is read. empty is the message to show if there are none.
+    """
+    empty = "\nThere are no entries numbered {} in the current log.\n".format(
+        first if first == last else '{}..{}'.format(first, last))
+    try:
+        log_path = _log_path()
+        if _backend() == 'sqlite':
+            return _db_rows(log_path, entries=(first, last)), None, empty
+        segments = _load_manifest(log_path)
+        os.stat(log_path)
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
+    parts = [(segment[0], segment[1]) for segment in segments if segment[1] <= last and segment[2] >= first]
+    if _entry_base(log_path, segments) < last:
+        parts.append((log_path, _entry_base(log_path, segments) + 1))
+    outcomes = _load_outcomes(log_path)
+
+    def rows():
+        for path, base in parts:
+            offsets = _entry_offsets(path)
+            lo, hi = max(first - base, 0), min(last - base + 1, len(offsets))
+            if lo >= hi:
+                continue
+            with _open_log(path) as log:
+                log.seek(int(offsets[lo]))
+                lines = itertools.islice((line for line in log if line.strip()), hi - lo)
+                for entry, line in enumerate(lines, base + lo):
+                    fields = _split_entry(line.decode('utf-8', 'replace'))
+                    if entry in outcomes:
+                        fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                    yield entry, fields
+
+    return rows(), None, empty
+
+
+def list_flags():
+
+    # The flag index of the log and of any closed segments holds every flag and the entries using it
+    try:
+        postings = _db_flags(_log_path()) if _backend() == 'sqlite' else _index_lookup(_log_path(), 'flags')
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
 
     # Create some string variables to hold the final output
-    data = str()
     output = list()
     header = str("""
     Below are the flags being used in the current log
@@ -300,45 +2232,566 @@ def list_flags():
         {: <10} {: <15} {: <}
         {: <10} {: <15} {: <}""".format("Count", "Flag", "Entries", "-----", "-----", "-------\n"))
 
-    # For each unique flag, count how many times it appears, and find which lines it appears on
-    # Then create a line of text with this information and add it to the output variable
-    for flag in flags:
-        count = len(log[[flag in entry.split() for entry in log['Flag']]])
-        entrylist = list(log[[flag in entry.split() for entry in log['Flag']]].index)
-        data = "\n".join([data, "\t{: <10} {: <15} {: <}".format(str(count), flag, str(entrylist))])
-
-        output = data.splitlines()
+    # For each unique flag, the index already holds how many times it appears and on which entries
+    # Create a line of text with this information and add it to the output variable
+    for flag, hits in postings.items():
+        entrylist = [entry for entry, _, _ in hits]
+        output.append("\t{: <10} {: <15} {: <}".format(str(len(entrylist)), flag, str(entrylist)))
 
+    if output:
+        output.append('')
     output.sort(reverse=True)
     output = "\n".join(output)
 
     return [header, output]
 
 
-def search_log(flags):
+def _db_flags(log_path):
+    # {flag: [(entry, database, None), ...]} for every flag in a log's database, shaped like _index_lookup()
+    db = _db_connect(log_path)
+    try:
+        postings = dict()
+        for flag, entry in db.execute('SELECT flag, entry FROM flags ORDER BY flag, entry'):
+            postings.setdefault(flag, []).append((entry, _db_path(log_path), None))
+    finally:
+        db.close()
+    return postings
+
+
+def _flag_hits(log_path, flags, since=None, until=None):
+    # Return (entries, rows) for every entry of the log tagged with any of the flags.
+    # Closed segments are only opened if the manifest says they hold one of the flags
+    found = _index_lookup(log_path, 'flags', lambda flag: flag in flags, since, until,
+                          lambda segment: segment[5].intersection(flags))
+    return _read_hits(sorted(set(hit for hits in found.values() for hit in hits)), since, until)
+
+
+# Live tail
+#
+# 'opslog --follow [Flag ...]' prints entries as they are appended to the current operator's log, or
+# to every log with --all-operators, keeping only those tagged with one of the flags if any are given.
+# --tail N prints the last N entries first. A csv log is read on from the byte offset the previous read
+# stopped at, so only new bytes are ever read. If the log was rotated in between, the rest of its old
+# entries are read from the newest segment, which keeps their offsets. A database is asked for the
+# entries numbered after the last one seen. Command outcomes are printed when they are recorded. On
+# Linux the process sleeps in inotify until something in the log directory changes; elsewhere it
+# checks every _follow_poll seconds.
+_follow_poll = 0.25
+
+# IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE. A database commit is only visible once the
+# writer is done with it, which the close tells
+_inotify_mask = 0x002 | 0x008 | 0x080 | 0x100
+
+
+def _inotify(directory):
+    # Return an inotify descriptor watching directory, or None where inotify is not available
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _inotify_mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def _follow_wait(fd):
+    # Sleep until something changes and return the names of the files that did, or None if unknown
+    if fd is None:
+        time.sleep(_follow_poll)
+        return None
+    data = os.read(fd, 1 << 16)
+    names = set()
+    position = 0
+    while position + 16 <= len(data):
+        _, _, _, length = struct.unpack_from('iIII', data, position)
+        names.add(os.fsdecode(data[position + 16:position + 16 + length].rstrip(b'\0')))
+        position += 16 + length
+    return names
+
+
+def _follow_start(operator, tail=0, everything=False):
+    # Start following one operator's log from its end, or from its start with everything. Returns the
+    # follow state and the last max(tail, _width_rows) entries before that point as (entry, fields)
+    # rows, with outcomes joined on, which size the columns
+    log_path = _log_path(operator)
+    state = {'path': log_path, 'prefix': os.path.basename(log_path)[:-len('csv')], 'pending': set(),
+             'entry': 0, 'offset': 0, 'inode': None, 'results': None, 'manifest': None, 'db': None}
+    keep = 0 if everything else max(tail or 0, _width_rows)
+    rows = list()
+    outcomes = dict()
+    try:
+        if _backend() == 'sqlite':
+            rows = list(_db_rows(log_path, tail=keep, joined=False)) if keep else list()
+            db = _db_connect(log_path)
+            try:
+                outcomes = _db_outcomes(db, [entry for entry, _ in rows])
+                state['entry'] = rows[-1][0] if rows else 0
+            finally:
+                db.close()
+        elif everything:
+            state.update(manifest=_file_size(_manifest_path(log_path)), entry=_entry_base(log_path))
+        else:
+            state['manifest'] = _file_size(_manifest_path(log_path))
+            cache, buffer = _update_cache(log_path)
+            first = _entry_base(log_path) + 1
+            lo = max(cache[3] - keep, 0)
+            rows = [(entry, list(fields)) for entry, fields in
+                    enumerate(zip(*_cache_slice(cache, buffer, lo, cache[3])), first + lo)]
+            outcomes = _load_outcomes(log_path)
+            state.update(offset=cache[0], inode=cache[2], entry=first + cache[3] - 1)
+    except FileNotFoundError:
+        if _backend() != 'sqlite':
+            state['entry'] = _entry_base(log_path)
 
-    log = _get_log()
+    # Commands still running get their outcome printed when it is recorded
+    for entry, fields in rows:
+        if entry in outcomes:
+            fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+        elif fields[6] == 'yes':
+            state['pending'].add(entry)
+    return state, rows
 
-    entrylist = list()
-    entryhit = bool()
-    for entry in log['Flag']:
-        for flag in flags:
-            if flag in entry.split():
-                entrylist.append(True)
-                entryhit = True
-                break
-        if not entryhit:
-            entrylist.append(False)
-        entryhit = False
 
-    return log[entrylist]
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _follow_read(state):
+    # Return the (entry, fields) rows appended to a followed log since the last read, without outcomes,
+    # and (entry, outcome) for each pending command whose outcome has been recorded since
+    log_path = state['path']
+    if _backend() == 'sqlite':
+        # One connection stays open for as long as the log is followed. Opening and closing one on
+        # every change would touch the database's files and wake the follower up again
+        if state['db'] is None:
+            try:
+                state['db'] = _db_connect(log_path)
+            except FileNotFoundError:
+                return [], []
+        db = state['db']
+        rows = [(entry, list(fields)) for entry, *fields in db.execute(
+            'SELECT entry, {} FROM entries WHERE entry > ? ORDER BY entry'.format(_db_columns), (state['entry'],))]
+        if rows:
+            state['entry'] = rows[-1][0]
+        pending = state['pending'].union(entry for entry, fields in rows if fields[6] == 'yes')
+        return rows, _follow_outcomes(state, rows, _db_outcomes(db, sorted(pending)) if pending else dict())
+
+    # Only whole lines up to end are read, a line still being written is picked up next time. Reading
+    # from the start skips the header
+    def read(log, offset, end=None):
+        log.seek(offset)
+        start = offset or len(log.readline())
+        data = log.read() if end is None else log.read(max(end - start, 0))
+        data = data[:data.rfind(b'\n') + 1]
+        lines = [line for line in data.decode('utf-8', 'replace').split('\n')[:-1] if line.strip()]
+        return start + len(data), [_split_entry(line) for line in lines]
 
+    try:
+        log = open(log_path, 'rb')
+    except FileNotFoundError:
+        return [], []
+
+    # A rotation moves the entries to a new segment and starts the log over. Any of them not read yet
+    # are read from the segments, where they kept their offsets. The shared lock keeps a rotation from
+    # happening halfway through
+    new = list()
+    with log:
+        fcntl.flock(log, fcntl.LOCK_SH)
+        manifest = _file_size(_manifest_path(log_path))
+        inode = os.fstat(log.fileno()).st_ino
+        if manifest != state['manifest'] or (state['inode'] is not None and inode != state['inode']):
+            for segment in _load_manifest(log_path):
+                if segment[2] > state['entry']:
+                    with _open_log(segment[0]) as closed:
+                        offset = state['offset'] if segment[1] <= state['entry'] + 1 else 0
+                        new.extend(read(closed, offset)[1])
+            state.update(offset=0, manifest=manifest)
+        state['offset'], lines = read(log, state['offset'], _intact_end(log_path, os.fstat(log.fileno())))
+    state['inode'] = inode
+    rows = list(enumerate(new + lines, state['entry'] + 1))
+    state['entry'] += len(rows)
+
+    # The outcomes are only read again when more have been recorded
+    outcomes = dict()
+    results = _file_size(_results_path(log_path))
+    if state['pending'] and results != state['results']:
+        outcomes = _load_outcomes(log_path)
+    state['results'] = results
+    return rows, _follow_outcomes(state, rows, outcomes)
+
+
+def _follow_outcomes(state, rows, outcomes):
+    # Move the commands among rows to the pending ones, then return (entry, outcome) for those that
+    # have an outcome in outcomes, which stop being pending
+    state['pending'].update(entry for entry, fields in rows if fields[6] == 'yes')
+    finished = sorted(entry for entry in state['pending'] if entry in outcomes)
+    state['pending'].difference_update(finished)
+    return [(entry, outcomes[entry]) for entry in finished]
+
+
+def follow_log(flags=None, tail=0, all_operators=False):
+    """Print entries as they are logged until interrupted, see the Live tail notes above"""
+    flags = set(flags or ())
+    fd = _inotify(_logdir)
+    followed = dict()
+
+    def wanted(fields):
+        return not flags or bool(flags.intersection(fields[2].split()))
+
+    # The columns are sized from the last entries of every log, the last tail of them are printed
+    recent = list()
+    for operator in _operators() if all_operators else [get_operator()]:
+        followed[operator], rows = _follow_start(operator, tail)
+        recent.extend((fields[0], operator, entry, fields) for entry, fields in rows)
+    recent.sort(key=lambda row: row[:3])
+    entry_width, widths, _ = _table_widths((entry, fields) for _, _, entry, fields in recent[-_width_rows:])
+    entry_width = max(entry_width, 6)
+    shown = [row for row in recent if wanted(row[3])][-tail:] if tail else []
+    for operator, state in followed.items():
+        state['pending'].intersection_update(entry for _, name, entry, _ in shown if name == operator)
 
-def _export_log(location, style, log=None):
+    try:
+        print("\nFollowing {} (Ctrl-C to stop)\n".format("every operator's log" if all_operators else _log_path()))
+        _write_table([(entry, fields) for _, _, entry, fields in shown], entry_width, widths, sys.stdout)
+        sys.stdout.flush()
+        while True:
+            names = _follow_wait(fd)
+
+            # Operators who log for the first time are followed from their first entry
+            if all_operators and (names is None or any(name.endswith(('_ops_log.csv', '_ops_log.db')) for name in names)):
+                for operator in _operators():
+                    if operator not in followed:
+                        followed[operator] = _follow_start(operator, everything=True)[0]
+
+            for state in followed.values():
+                if names is not None and not any(name.startswith(state['prefix']) for name in names):
+                    continue
+                rows, outcomes = _follow_read(state)
+                lines = [(entry, fields) for entry, fields in rows if wanted(fields)]
+                state['pending'].difference_update(entry for entry, fields in rows if not wanted(fields))
+                for entry, outcome in outcomes:
+                    lines.append((entry, [''] * 7 + ['command finished' + _outcome_fields('', '', outcome)[1]]))
+                _write_table(lines, entry_width, widths, sys.stdout, header=False)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print()
+    except BrokenPipeError:
+        _stdout_closed()
+    finally:
+        if fd is not None:
+            os.close(fd)
+        for state in followed.values():
+            if state['db'] is not None:
+                state['db'].close()
+
+
+# Activity report
+#
+# --stats counts entries per flag, PAA, target, day and hour of the day, and how many logged
+# commands ran and failed. It works on whole columns of the parse caches at once: the flag and
+# target columns are split as one string each and counted. Columns whose values all fit in 8 bytes
+# (PAA, Executed) are packed into one integer per row and counted with numpy, as are the hour and
+# day of every entry, read straight out of the Date column.
+_stats_top = 20
+
+
+def _column_text(cache, buffer, column, lo, hi):
+    # The values of one column of a parsed cache in rows [lo, hi) as one string, each ending in a newline
+    offsets, position = cache[6][column]
+    return buffer[position + int(offsets[lo]):position + int(offsets[hi])].decode('utf-8', 'replace')
+
+
+def _value_counts(cache, buffer, column, lo, hi):
+    # Counter of the values of one column of a parsed cache in rows [lo, hi)
+    import numpy
+    offsets, position = cache[6][column]
+    lengths = offsets[lo + 1:hi + 1] - offsets[lo:hi] - 1
+    if lengths.max() > 8:
+        return collections.Counter(_column_text(cache, buffer, column, lo, hi).split('\n')[:-1])
+
+    # Zero pad every value to 8 bytes and read each row as one integer
+    data = numpy.frombuffer(buffer, 'u1')
+    starts = position + offsets[lo:hi]
+    packed = numpy.zeros((hi - lo, 8), 'u1')
+    for byte in range(int(lengths.max())):
+        present = lengths > byte
+        packed[present, byte] = data[starts[present] + byte]
+    keys, counts = numpy.unique(packed.view('<u8').ravel(), return_counts=True)
+    values = keys.view('S8')
+    return collections.Counter({value.decode('utf-8', 'replace'): int(count) for value, count in zip(values, counts)})
+
+
+def _legacy_failures(stats, failed):
+    # Count entries whose command failed before outcomes were kept beside the log. The log entry itself
+    # was rewritten to Executed 'no' with the error appended to its note, but the command did run
+    stats['failed'][''] += failed
+    stats['executed']['yes'] += failed
+    stats['executed']['no'] -= failed
+
+
+@_timed('stats')
+def _log_stats(log_path, since=None, until=None):
+    # Return {count name: Counter} for the entries of one log and its closed segments in the time window
+    if _backend() == 'sqlite':
+        return _db_stats(log_path, since, until)
+    import numpy
+    stats = collections.defaultdict(collections.Counter)
+    outcomes = _load_outcomes(log_path)
+    for path, first in _log_parts(log_path, since, until):
+        cache, buffer = _update_cache(path)
+        lo, hi = _cache_range(cache, buffer, since, until)
+        if hi <= lo:
+            continue
+        stats['entries'][''] += hi - lo
+        for name, column in (('paa', 3), ('executed', 6)):
+            stats[name].update(_value_counts(cache, buffer, column, lo, hi))
+        stats['flags'].update(_column_text(cache, buffer, 2, lo, hi).split())
+        stats['targets'].update(_column_text(cache, buffer, 4, lo, hi).replace(',', ' ').split())
+
+        # The first 13 bytes of every date are YYYY-MM-DD HH. Entries are in date order, so each
+        # day is one run of rows and only the rows where the day changes need looking at
+        offsets, position = cache[6][0]
+        if offsets[hi] - offsets[lo] == 20 * (hi - lo):
+            dates = numpy.frombuffer(buffer, 'u1', 20 * (hi - lo), position + int(offsets[lo])).reshape(-1, 20)
+        else:
+            dates = numpy.frombuffer(buffer, 'u1')[position + offsets[lo:hi, None] + numpy.arange(13)]
+        runs = numpy.concatenate(([0], numpy.flatnonzero((dates[1:, :10] != dates[:-1, :10]).any(axis=1)) + 1))
+        for day, count in zip(dates[runs, :10], numpy.diff(numpy.append(runs, len(dates)))):
+            stats['days'][day.tobytes().decode('utf-8', 'replace')] += int(count)
+        hours = (dates[:, 11].astype(int) - 48) * 10 + dates[:, 12] - 48
+        counts = numpy.bincount(hours[(hours >= 0) & (hours < 24)], minlength=24)
+        stats['hours'].update(dict(enumerate(counts.tolist())))
+
+        # Failed commands show up in the outcomes, or in the log itself for those logged before outcomes
+        # were kept beside it
+        failed = sum(1 for entry, outcome in outcomes.items() if first + lo <= entry < first + hi and outcome[1])
+        stats['failed'][''] += failed
+        notes = _column_text(cache, buffer, 7, lo, hi)
+        if _legacy_error in notes:
+            executed = _column_text(cache, buffer, 6, lo, hi).split('\n')
+            _legacy_failures(stats, sum(1 for entry, (value, note) in enumerate(zip(executed, notes.split('\n')), first + lo)
+                                        if value == 'no' and _legacy_error in note and entry not in outcomes))
+    return stats
+
+
+def log_stats(since=None, until=None, all_operators=False):
+    """Return the --stats report for the current operator's log (or every operator's) as text"""
+    total = collections.defaultdict(collections.Counter)
+    try:
+        for operator in _operators() if all_operators else [get_operator()]:
+            stats = _log_stats(_log_path(operator), since, until)
+            for name, counts in stats.items():
+                total[name].update(counts)
+            total['operators'][operator] += stats['entries']['']
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
+
+    entries = total['entries']['']
+    if not entries:
+        return "\nThere are no entries in the log to report on.\n"
+    executed = total['executed']['yes']
+    failed = total['failed']['']
+    lines = ["", "    Activity in the {} between {} and {}".format(
+                 "logs of every operator" if all_operators else "current log",
+                 min(total['days']), max(total['days'])), "",
+             "        {: <28} {}".format("Entries", entries),
+             "        {: <28} {}".format("Commands logged", entries - total['executed']['']),
+             "        {: <28} {}".format("Commands executed", executed),
+             "        {: <28} {} ({:.1%} of executed)".format("Commands failed", failed,
+                                                            failed / executed if executed else 0)]
+
+    def table(title, counts):
+        lines.extend(["", "    {}".format(title), "",
+                      "        {: <10} {: <}".format("Count", "Value"),
+                      "        {: <10} {: <}".format("-----", "-----")])
+        for value, count in counts:
+            lines.append("        {: <10} {: <}".format(count, value if value != '' else '(none)'))
+
+    def most(counts, top=None):
+        # Highest counts first, ties in order of value so the report does not depend on read order
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+
+    if all_operators:
+        table("Entries per operator", most(total['operators']))
+    table("Entries per flag", most(total['flags']))
+    table("Entries per pre-approved action", most(total['paa']))
+    table("Entries per target (top {})".format(_stats_top), most(total['targets'], _stats_top))
+    table("Entries per day", sorted(total['days'].items()))
+    # Every hour is listed, quiet ones too, whichever backend counted them
+    table("Entries per hour of the day (UTC)",
+          [('{:02}:00'.format(hour), total['hours'][hour]) for hour in range(24)])
+    return "\n".join(lines) + "\n"
+
+
+def search_log(flags, since=None, until=None, all_operators=False):
+
+    if all_operators:
+        lines = _all_operator_lines(flags, since, until)
+        return ((entry, _split_entry(line.decode('utf-8', 'replace'))) for entry, line in lines)
+
+    try:
+        log_path = _log_path()
+        if _backend() == 'sqlite':
+            return _db_rows(log_path, since, until, flags=flags)
+        entries, rows = _flag_hits(log_path, flags, since, until)
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
+
+    return _joined_rows(entries, rows, _load_outcomes(log_path))
+
+
+def grep_log(terms, since=None, until=None):
+
+    terms = [term.lower() for term in terms]
+    words = set(word for term in terms for word in _words(term))
+    try:
+        log_path = _log_path()
+        if _backend() == 'sqlite':
+            rows = list(_db_rows(log_path, since, until, terms=terms))
+            if not rows:
+                print("\nThere are no entries in current log containing all of the provided text.\n")
+                sys.exit()
+            return iter(rows)
+        found = _index_lookup(log_path, 'words', lambda key: any(word in key for word in words), since, until)
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
+
+    # An entry is a candidate if every word of every term is part of one of its indexed words
+    if words:
+        candidates = None
+        for word in words:
+            hits = set(hit for key, key_hits in found.items() if word in key for hit in key_hits)
+            candidates = hits if candidates is None else candidates & hits
+        entries, rows = _read_hits(sorted(candidates), since, until)
+
+    # Terms made only of punctuation cannot be looked up, so every entry in the window is checked
+    else:
+        entries = list()
+        rows = list()
+        for entry, line in _log_lines(log_path, since, until):
+            entries.append(entry)
+            rows.append(_split_entry(line.decode('utf-8', 'replace')))
+
+    # Keep the entries whose note or command syntax really contains every term
+    keep = [n for n, row in enumerate(rows)
+            if all(term in row[5].lower() or term in row[7].lower() for term in terms)]
+    if not keep:
+        print("\nThere are no entries in current log containing all of the provided text.\n")
+        sys.exit()
+    return _joined_rows([entries[n] for n in keep], [rows[n] for n in keep], _load_outcomes(log_path))
+
+
+def target_log(network, since=None, until=None):
+
+    # Every network ever logged is a key of the target index, so only the postings of the
+    # networks overlapping the target are read
+    try:
+        log_path = _log_path()
+        if _backend() == 'sqlite':
+            hits = list(_db_rows(log_path, since, until, targets=_overlapping(network)))
+            entries, rows = [entry for entry, _ in hits], None
+        else:
+            found = _index_lookup(log_path, 'targets', _overlapping(network), since, until)
+            entries, rows = _read_hits(sorted(set(hit for hits in found.values() for hit in hits)), since, until)
+    except FileNotFoundError:
+        print("No log for current operator.")
+        sys.exit()
+
+    if not entries:
+        print("\nThere are no entries in current log targeting {}.\n".format(network))
+        sys.exit()
+    if rows is None:
+        return iter(hits)
+    return _joined_rows(entries, rows, _load_outcomes(log_path))
+
+
+def _operator_lines(operator, flags=None, since=None, until=None):
+    # Yield (entry, raw line) for one operator's entries, in log order. Entry numbers only mean
+    # something within one log, so command outcomes are joined on here.
+    log_path = _log_path(operator)
+    try:
+        if _backend() == 'sqlite':
+            yield from _db_lines(log_path, since, until, flags=flags)
+            return
+        outcomes = _load_outcomes(log_path)
+        if flags:
+            lines = ((entry, (';'.join(row) + "\n").encode('utf-8'))
+                     for entry, row in zip(*_flag_hits(log_path, flags, since, until)))
+        else:
+            lines = _log_lines(log_path, since, until)
+        for entry, line in lines:
+            if entry in outcomes:
+                fields = _split_entry(line.decode('utf-8', 'replace'))
+                fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                line = (';'.join(fields) + "\n").encode('utf-8')
+            yield entry, line
+    except FileNotFoundError:
+        return
+
+
+def _operator_chunk(directory, operator, flags=None, since=None, until=None):
+    # Worker for --all-operators: write one operator's entries to a file in directory as they are
+    # read, each line prefixed with its entry number, and return the file's name
+    path = os.path.join(directory, operator)
+    with open(path, 'wb', buffering=1 << 20) as chunk:
+        for entry, line in _operator_lines(operator, flags, since, until):
+            chunk.write(b'%d;' % entry + line)
+    return path
 
-    if isinstance(log, type(None)):
-        log = os.path.join(_logdir, get_operator() + "_ops_log.csv")
 
+def _chunk_lines(path):
+    # Read back the (entry, raw line) pairs written by _operator_chunk()
+    with open(path, 'rb', buffering=1 << 20) as chunk:
+        for line in chunk:
+            entry, _, line = line.partition(b';')
+            yield int(entry), line
+
+
+def _all_operator_lines(flags=None, since=None, until=None):
+    """Yield (entry number, raw line) for the entries of every operator's log, merged in date order.
+
+    Each operator's log is read in its own worker process, limited to the flags and time window,
+    and written to a file of its own. The files are then merged as streams, so only one line per
+    operator is held in memory. Entry numbers are those of the operator's own log and command
+    outcomes are already joined on.
+    """
+    tasks = [(operator, flags, since, until) for operator in _operators()]
+    if len(tasks) < 2:
+        for task in tasks:
+            yield from _operator_lines(*task)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with TemporaryDirectory(prefix='opslog-') as directory:
+        with ProcessPoolExecutor(min(len(tasks), os.cpu_count() or 1)) as pool:
+            chunks = list(pool.map(_operator_chunk, itertools.repeat(directory), *zip(*tasks)))
+
+        # Every operator's entries are already in date order, so a heap merge keeps the result in order
+        yield from heapq.merge(*[_chunk_lines(path) for path in chunks], key=lambda hit: hit[1][:19])
+
+
+def _all_operators_log(flags=None, since=None, until=None):
+    # Load the entries of every operator's log into one table, ordered by date
+    entries = list()
+    rows = list()
+    for entry, line in _all_operator_lines(flags, since, until):
+        entries.append(entry)
+        rows.append(_split_entry(line.decode('utf-8', 'replace')))
+    return _entry_frame(entries, rows)
+
+
+def _confirm_overwrite(location):
     # First check to see if file already exists and if it does, make sure user wishes to overwrite
     if os.path.isfile(location):
         response = input(location + " already exists. Do you wish to overwrite? (y/n)")
@@ -346,37 +2799,305 @@ def _export_log(location, style, log=None):
             print("Aborting export of log file")
             sys.exit()
 
+
+def _open_export(location, mode='w'):
+    # Destinations ending in .gz are gzip compressed as they are written
+    if location.endswith('.gz'):
+        return gzip.open(location, mode if 'b' in mode else mode + 't')
+    return open(location, mode)
+
+
+def _write_json(rows, f, empty=None):
+    # Write rows one at a time in the same layout json.dumps(rows, indent=4, separators=(';', ': '))
+    # produces for the whole list. To add rows to an array whose closing bracket was cut off by
+    # _reopen_json(), pass whether that array was empty
+    if empty is None:
+        f.write('[')
+        empty = True
+    for row in rows:
+        f.write('\n' if empty else ';\n')
+        f.write('    ' + json.dumps(row, sort_keys=False, indent=4, separators=(';', ': ')).replace('\n', '\n    '))
+        empty = False
+    f.write(']' if empty else '\n]')
+
+
+def _reopen_json(location):
+    # Cut the closing bracket off a json export so more rows can be written after the last one.
+    # Returns whether the array was empty
+    with open(location, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(size - 2, 0))
+        tail = f.read()
+        if not tail.endswith(b']'):
+            raise IOError("{} does not end like a json export".format(location))
+        empty = not tail.endswith(b'\n]')
+        f.truncate(size - (1 if empty else 2))
+    return empty
+
+
+@_timed('export')
+def _write_export(location, style, lines, outcomes=None, append=False):
+    """Write log lines to location in the given format.
+
+    lines is an iterable of (entry number, raw line) that starts with the header line, whose entry
+    number is None. For json, ndjson and default a line can also be the list of its fields. Command outcomes are joined onto their entries by entry number. Every format is
+    written row by row as it is read. With append, the rows are added to what a previous
+    csv, ndjson or (uncompressed) json export left at location.
+    """
+    outcomes = outcomes or dict()
+    lines = iter(lines)
+    _, header = next(lines)
+
+    # if no format was specified or if default was specified, output the table --cat shows, numbered
+    # from 0. The table needs the widest value of every column before its first row, so the rows are
+    # spooled to a temporary file while they are measured and then written from it
+    if style.lower() == 'default' or style.lower() == 'd':
+        entry_width = 0
+        widths = [0] * len(_log_header.split(';'))
+        with TemporaryFile() as spool:
+            for number, (entry, line) in enumerate(lines):
+                fields = line if isinstance(line, list) else _split_entry(line.decode('utf-8', 'replace'))
+                if entry in outcomes:
+                    fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                number = str(number if entry is None else entry - 1)
+                entry_width = max(entry_width, len(number))
+                widths = [max(width, len(value)) for width, value in zip(widths, fields)]
+                spool.write((number + ';' + ';'.join(fields) + "\n").encode('utf-8'))
+            spool.seek(0)
+            rows = (line.decode('utf-8').rstrip('\n').split(';', 1) for line in spool)
+            with _open_export(location) as f:
+                _write_table(((number, _split_entry(rest)) for number, rest in rows), entry_width, widths, f)
+
+    # csv lines are copied as they are, with command outcomes joined on
+    elif style.lower() == 'csv':
+        with _open_export(location, 'ab' if append else 'wb') as f:
+            if not append:
+                f.write(header)
+            for entry, line in lines:
+                if entry in outcomes:
+                    fields = _split_entry(line.decode('utf-8', 'replace'))
+                    fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                    line = (';'.join(fields) + "\n").encode('utf-8')
+                f.write(line)
+
+    # if json format was specified, create json file from csv and save to output location
+    # ndjson writes one json object per line instead of a single array
+    elif style.lower() in ('json', 'ndjson'):
+        # Lines are split like the log itself, so a ';' in a note stays part of the note.
+        # Rows read from the database come already split
+        title = _split_entry(header.decode('utf-8', 'replace'))
+
+        def rows():
+            for entry, line in lines:
+                fields = line if isinstance(line, list) else _split_entry(line.decode('utf-8', 'replace'))
+                if entry in outcomes:
+                    fields[6], fields[7] = _outcome_fields(fields[6], fields[7], outcomes[entry])
+                yield dict(zip(title, fields))
+
+        empty = _reopen_json(location) if append and style.lower() == 'json' else None
+        with _open_export(location, 'a' if append else 'w') as f:
+            if style.lower() == 'json':
+                _write_json(rows(), f, empty)
+            else:
+                f.writelines(json.dumps(row) + "\n" for row in rows())
+
+    # If any other format was entered, raise TypeError
+    else:
+        raise TypeError("Export failed: unknown filetype {}".format(style))
+
+
+# Export checkpoints
+#
+# <operator>_ops_log.exports remembers, for every destination exported to with --incremental, the
+# format used, the last entry written (its number, byte offset and crc32) and the size the
+# destination was left at. The next incremental export checks that the log still holds that entry
+# unchanged, in the current log or in the closed segment it has been rotated into, and that the
+# destination was not touched since, then appends only the entries after it. Anything else (a
+# rewritten log, a destination that was moved or changed) starts the destination over with a full
+# export. Command outcomes recorded after an entry was exported are not sent again.
+_exports_header = 'Destination;Format;Entry;Offset;Hash;Size'
+
+
+def _exports_path(log_path):
+    return _index_path(log_path, 'exports')
+
+
+def _load_checkpoints(log_path):
+    """Return {destination: (format, entry, offset, crc32, destination size)} for every incremental export of the log"""
+    checkpoints = dict()
+    try:
+        with open(_exports_path(log_path)) as exports:
+            exports.readline()
+            for line in exports:
+                destination, style, *fields = line.rstrip('\n').rsplit(';', 5)
+                checkpoints[destination] = (style,) + tuple(int(field) for field in fields)
+    except FileNotFoundError:
+        pass
+    return checkpoints
+
+
+def _save_checkpoint(log_path, destination, checkpoint):
+    checkpoints = _load_checkpoints(log_path)
+    checkpoints[destination] = checkpoint
+    exports_path = _exports_path(log_path)
+    with open(exports_path + '.tmp{}'.format(os.getpid()), 'w') as exports:
+        exports.write(_exports_header + "\n")
+        for name, fields in checkpoints.items():
+            exports.write(';'.join(str(field) for field in (name,) + fields) + "\n")
+    os.replace(exports.name, exports_path)
+
+
+def _lines_after(log_path, entry=0, offset=0, crc=0):
+    """Yield (entry number, offset, raw line) for every entry of the log and its closed segments after entry.
+
+    offset and crc are where that entry starts in the file now holding it and the crc32 of its line.
+    Raises ValueError if the log no longer holds it. A last line still being written and a torn tail
+    are left out.
+    """
+    segments = _load_manifest(log_path)
+    files = [(segment[0], segment[1], segment[2]) for segment in segments]
+    files.append((log_path, _entry_base(log_path, segments) + 1, None))
+    if entry and not any(first <= entry and (last is None or entry <= last) for _, first, last in files):
+        raise ValueError('entry {} is no longer in the log'.format(entry))
+
+    for path, first, last in files:
+        if last is not None and last < entry:
+            continue
+        with _open_log(path) as log:
+            position = len(log.readline())
+            number = first
+            if entry >= first:
+                log.seek(offset)
+                line = log.readline()
+                if zlib.crc32(line) != crc:
+                    raise ValueError('entry {} has changed'.format(entry))
+                position = offset + len(line)
+                number = entry + 1
+            end = _intact_end(path, os.fstat(log.fileno())) if last is None else None
+            for line in log:
+                if not line.endswith(b'\n') or (end is not None and position >= end):
+                    break
+                if line.strip():
+                    yield number, position, line
+                    number += 1
+                position += len(line)
+
+
+def _export_incremental(location, style, log):
+    # Append the entries logged since the last incremental export to location, or export everything
+    # if the checkpoint of location no longer matches the log or location itself
+    if style.lower() not in ('csv', 'ndjson', 'json') or (style.lower() == 'json' and location.endswith('.gz')):
+        print("--incremental works with the csv and ndjson formats, and json when not compressed")
+        return
+
+    destination = os.path.abspath(location)
+    checkpoint = _load_checkpoints(log).get(destination)
+    append = checkpoint is not None and checkpoint[0] == style.lower() and os.path.isfile(location) \
+        and os.path.getsize(location) == checkpoint[4]
+    if checkpoint is None:
+        _confirm_overwrite(location)
+    elif not append:
+        print("{} or the log changed since the last export, exporting every entry again".format(location))
+
     try:
+        with open(log, 'rb') as csvfile:
+            header = csvfile.readline()
+        lines = _lines_after(log, *checkpoint[1:4]) if append else _lines_after(log)
+        first = next(lines, None) if append else None
+    except ValueError:
+        print("{} or the log changed since the last export, exporting every entry again".format(location))
+        append = False
+        lines = _lines_after(log)
+        first = None
+
+    # Remember the last entry written as it goes past
+    last = list(checkpoint[1:4]) if append else [0, 0, 0]
+    exported = [0]
+
+    def tracked():
+        for entry, offset, line in itertools.chain([first] if first else [], lines):
+            last[:] = entry, offset, zlib.crc32(line)
+            exported[0] += 1
+            yield entry, line
 
-        # if no format was specified or if default was specified, output in pandas matrix format
-        if style.lower() == 'default' or style.lower() == 'd':
-            with open(location, 'w+') as f:
-                f.write(display_log(read_csv(log, delimiter=';').fillna('')))
-                f.write("\n")
+    try:
+        if append and first is None:
+            print("No new entries to export")
+            return
+        _write_export(location, style, itertools.chain([(None, header)], tracked()), _load_outcomes(log), append)
+        _save_checkpoint(log, destination, (style.lower(), *last, os.path.getsize(location)))
+        print("Exported {} {}entries".format(exported[0], 'new ' if append else ''))
+    except IOError as e:
+        print('Operation failed due to error: \n  ' + str(e))
 
-        # If csv format was specified, simply copy the log file to output location
-        elif style.lower() == 'csv':
-            copyfile(log, location)
 
-        # if json format was specified, create json file from csv and save to output location
-        elif style.lower() == 'json':
-            input_file = log
-            output_file = location
+def _export_log(location, style, log=None, since=None, until=None, all_operators=False, incremental=False):
 
-            csv_rows = []
-            with open(input_file) as csvfile:
-                reader = DictReader(csvfile, delimiter=';')
-                title = reader.fieldnames
-                for row in reader:
-                    csv_rows.extend([{title[i]: row[title[i]] for i in range(len(title))}])
+    if isinstance(log, type(None)):
+        log = _log_path()
+
+    # Incremental exports pick up where the last one to the same destination stopped
+    if incremental:
+        if _backend() == 'sqlite':
+            print("--incremental only works with csv logs")
+            return
+        if since or until or all_operators:
+            print("--incremental cannot be combined with --since, --until or --all-operators")
+            return
+        try:
+            _export_incremental(location, style, log)
+        except FileNotFoundError:
+            print("No log for current operator.")
+        return
+
+    _confirm_overwrite(location)
+
+    # Every operator's entries go into one export, ordered by date
+    if all_operators:
+        try:
+            header = (_log_header + "\n").encode('utf-8')
+            _write_export(location, style, itertools.chain([(None, header)], _all_operator_lines(since=since, until=until)))
+            print('Operation Successful')
+        except IOError as e:
+            print('Operation failed due to error: \n  ' + str(e))
+        return
+
+    # The database is read row by row in every format, with command outcomes already joined on
+    if _backend() == 'sqlite':
+        try:
+            header = (_log_header + "\n").encode('utf-8')
+            rows = _db_lines(log, since, until) if style.lower() == 'csv' else _db_rows(log, since, until)
+            _write_export(location, style, itertools.chain([(None, header)], rows))
+            print('Operation Successful')
+        except FileNotFoundError:
+            print("No log for current operator.")
+        except IOError as e:
+            print('Operation failed due to error: \n  ' + str(e))
+        return
+
+    # Command outcomes are kept beside the log and joined onto their entries in every format
+    outcomes = _load_outcomes(log)
 
-                with open(output_file, "w") as f:
-                    f.write(json.dumps(csv_rows, sort_keys=False, indent=4,
-                                       separators=(';', ': ')))  # , encoding="utf-8", ensure_ascii=False))
+    try:
 
-        # If any other format was entered, raise TypeError
+        # If csv format was specified and nothing has to be changed, simply copy the log file (unless
+        # it ends in a torn tail). Otherwise stream the entries of the closed segments and the log,
+        # limited to any time window
+        if style.lower() == 'csv' and not outcomes and not since and not until \
+                and not location.endswith('.gz') and not _load_manifest(log) \
+                and _intact_end(log, os.stat(log)) == os.path.getsize(log):
+            copyfile(log, location)
+
+        # The default table is the one --cat shows, read from the parse cache the same way and
+        # numbered from 0 as it always has been
+        elif style.lower() == 'default' or style.lower() == 'd':
+            rows, (entry_width, widths), _ = _cat_rows(since, until)
+            with _open_export(location) as f:
+                _write_table(((entry - 1, fields) for entry, fields in rows), entry_width, widths, f)
         else:
-            raise TypeError("Export failed: unknown filetype {}".format(style))
+            with open(log, 'rb') as csvfile:
+                header = csvfile.readline()
+            _write_export(location, style, itertools.chain([(None, header)], _log_lines(log, since, until)), outcomes)
 
         # If export successful, tell user so
         print('Operation Successful')
@@ -388,25 +3109,142 @@ def _export_log(location, style, log=None):
     return
 
 
-def _merge_logs(logs_list):
+# Unsorted merge inputs are sorted externally in runs of this many lines
+_merge_run_lines = 100000
+
+
+def _log_stream(file, skip=()):
+    # Yield every entry of a log file without its newline, skipping the header, blank lines and
+    # the line numbers in skip
+    with open(file, 'r') as log:
+        log.readline()
+        for number, line in enumerate(log, 2):
+            line = line.rstrip('\r\n')
+            if line and number not in skip:
+                yield line
+
+
+def _sorted_runs(file, skip=()):
+    # External sort: split an unsorted log into sorted temporary runs and return a stream for each
+    runs = list()
+    stream = _log_stream(file, skip)
+    while True:
+        chunk = sorted(itertools.islice(stream, _merge_run_lines))
+        if not chunk:
+            break
+        run = TemporaryFile('w+')
+        run.writelines(line + "\n" for line in chunk)
+        run.seek(0)
+        runs.append(line.rstrip('\n') for line in run)
+    return runs
+
+
+# Merge inputs are validated in chunks of about this many bytes, spread over a process pool
+_validate_chunk_size = 1 << 24
+_log_format = re.compile(rb"^.*;.+;.*;.*;.*;.*;.*;.*")
+
+
+def _validate_chunk(file, start, end):
+    # Check the lines of file between byte offsets start and end (both on line boundaries).
+    # Returns (line count, [(line index, line), ...] for bad lines, first entry, last entry, in order)
+    if start >= end:
+        return 0, [], None, None, True
+    with open(file, 'rb') as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        lines = data[start:end].split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+
+    bad = list()
+    first = last = None
+    ordered = True
+    for n, line in enumerate(lines):
+        line = line.rstrip(b'\r')
+        if not line:
+            continue
+        if not _log_format.match(line):
+            bad.append((n, line.decode('utf-8', 'replace')))
+            continue
+        if last is not None and line < last:
+            ordered = False
+        first = line if first is None else first
+        last = line
+    return len(lines), bad, first, last, ordered
+
+
+def _validate_logs(logs_list):
+    """Check every line of each log against the log format.
+
+    Files are memory mapped and split into chunks that are checked in parallel.
+    Returns ({file: [(line number, line), ...]} for every bad line, set of files not in date order).
+    """
+    tasks = list()
+    for file in logs_list:
+        with open(file, 'rb') as log:
+            size = os.fstat(log.fileno()).st_size
+            start = len(log.readline())
+            while start < size:
+                log.seek(min(start + _validate_chunk_size, size))
+                log.readline()
+                tasks.append((file, start, log.tell()))
+                start = log.tell()
+
+    if len(tasks) > 1:
+        # Imported here as it pulls in multiprocessing, which the append path does not need
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor() as pool:
+            results = list(pool.map(_validate_chunk, *zip(*tasks)))
+    else:
+        results = [_validate_chunk(*task) for task in tasks]
+
+    # Stitch the chunks of each file back together in order
+    bad = dict()
+    unsorted = set()
+    numbers = dict()
+    lasts = dict()
+    for (file, _, _), (count, bad_lines, first, last, ordered) in zip(tasks, results):
+        base = numbers.get(file, 2)
+        bad.setdefault(file, []).extend((base + n, line) for n, line in bad_lines)
+        if not ordered or (first is not None and lasts.get(file) is not None and first < lasts[file]):
+            unsorted.add(file)
+        numbers[file] = base + count
+        lasts[file] = last if last is not None else lasts.get(file)
+    return {file: lines for file, lines in bad.items() if lines}, unsorted
+
+
+def _merge_streams(streams):
+    # Lazily merge date-ordered entry streams, dropping duplicates (which end up next to each other)
+    previous = None
+    for line in heapq.merge(*streams):
+        if line != previous:
+            yield line
+        previous = line
+
+
+@_timed('merge')
+def _merge_logs(logs_list, quarantine=None):
     print("Checking files...")
 
-    # First check that each file provided is the correct format
-    patern = re.compile("^.*;.+;.*;.*;.*;.*;.*;.*")
-    for file in logs_list:
-        with open(file, 'r') as log:
-            # Skip first line(header)
-            log.readline()
+    # First check that each file provided is the correct format, reporting every line that is not.
+    # While checking, note any file whose entries are not in date order so it can be sorted first
+    bad, unsorted = _validate_logs(logs_list)
+    for file, lines in bad.items():
+        for number, line in lines:
+            print("ERROR: file {} line {} does not match logging format: {}".format(file, number, line))
 
-            # Make sure each line of log (after header) matches correct csv log format
-            # If any line does not match, print error and exit
-            for line in log.readlines():
-                if not patern.match(line) and not line == "":
-                    print("ERROR: file {} does not match logging format. Unable to merge".format(file))
-                    sys.exit()
+    # Bad lines either stop the merge or, with a quarantine file, are set aside and left out
+    if bad and not quarantine:
+        print("Unable to merge. Use --quarantine FILE to merge without the lines listed above")
+        sys.exit()
+    elif bad:
+        with open(quarantine, 'a') as quarantined:
+            for file, lines in bad.items():
+                quarantined.writelines("{}:{}:{}\n".format(file, number, line) for number, line in lines)
+        print("{} bad lines moved to {}".format(sum(len(lines) for lines in bad.values()), quarantine))
+    skip = {file: set(number for number, _ in lines) for file, lines in bad.items()}
 
     # If all files specified match log format, ask user for output location.
-    print("All files matches log format.")
+    if not bad:
+        print("All files matches log format.")
 
     # After the user provides the output location, replace provided string with common aliases:
     # ./ for current dir, ../ for parent dir, and ~ for home dir
@@ -421,69 +3259,565 @@ def _merge_logs(logs_list):
 
     # Once output destination is validated, ask for output format
     # if no format is provided, set to default
-    dest_format = input("Enter destination log format(default, csv, json): ")
-    if dest_format.lower() not in list("default", "csv", "json"):
+    dest_format = input("Enter destination log format(default, csv, json, ndjson): ")
+    if dest_format.lower() not in ("default", "csv", "json", "ndjson"):
         print("Unrecognized output format. Using default format.")
         dest_format = 'default'
 
-    output = str()
-
+    # Merge the files as sorted streams so only one line per input is held in memory
+    streams = list()
     for file in logs_list:
-        with open(file, 'r') as log:
-            # for each file, skip first line(header), then copy all other lines to output variable
-            log.readline()
-            output = output + str(log.read())
-    result = sorted(set(output.splitlines()))
-
-    merged_file = NamedTemporaryFile(delete=False)
-
-    # Write header to new file followed by lines from all input files
-    with open(merged_file.name, "+a") as newlog:
-        newlog.writelines('Date;Operator;Flag;PAA;IPs;Command Syntax;Executed;Note\n')
-        newlog.writelines("\n".join(result))
-        newlog.write("\n")
-
-    _export_log(dest_file, dest_format, merged_file.name)
-    merged_file.close()
+        skipped = skip.get(file, ())
+        streams.extend(_sorted_runs(file, skipped) if file in unsorted else [_log_stream(file, skipped)])
+    merged = _merge_streams(streams)
+
+    # Write header followed by the merged lines from all input files straight to the destination
+    _confirm_overwrite(dest_file)
+    lines = itertools.chain([(None, (_log_header + '\n').encode('utf-8'))],
+                            ((None, (line + '\n').encode('utf-8')) for line in merged))
+    try:
+        _write_export(dest_file, dest_format, lines)
+        print('Operation Successful')
+    except IOError as e:
+        print('Operation failed due to error: \n  ' + str(e))
 
     sys.exit()
 
 
-def _run_command(command):
+# The last _capture_bytes of a command's stderr are kept to record why it failed
+_capture_bytes = 1 << 16
+
+
+def _output_path(log_path, entry):
+    # Where the output of a command run with --background goes
+    return log_path[:-len('.csv')] + '.{}.out'.format(entry)
+
+
+def _run_command(command, entry, offset, background=False):
+    """Run a -C command and record its outcome beside the log.
+
+    stdout goes straight to the terminal and stderr is copied to it as it arrives, keeping only
+    the last _capture_bytes to find the error in. With background, the command runs detached with
+    its output written to a file and this returns at once; the outcome is recorded when it ends.
+    """
+    log_path = _log_path()
+    if background:
+        output_path = _output_path(log_path, entry)
+        pid = os.fork()
+        if pid:
+            print("Running in the background (pid {}), output in {}".format(pid, output_path))
+            return
+        # The child lets go of the caller's terminal or pipe, so $(...) and pipes do not wait for it
+        os.setsid()
+        try:
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            output = os.open(output_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            for fd, target in ((devnull, 0), (output, 1), (output, 2)):
+                os.dup2(fd, target)
+            os.close(devnull)
+            os.close(output)
+            _execute(log_path, command, entry, offset, None, sys.stderr.buffer)
+        finally:
+            os._exit(0)
+
+    _execute(log_path, command, entry, offset, None, sys.stderr.buffer)
+
+
+@_timed('command')
+def _execute(log_path, command, entry, offset, stdout, stderr):
+    # Run the command with stdout going to stdout (None for the terminal) and stderr copied to
+    # stderr as it arrives, then record its start, duration and exit code
+    started = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    start = time.monotonic()
+    process = subprocess.Popen(['/bin/bash', '-i', '-c', command], stdout=stdout, stderr=subprocess.PIPE)
+
+    captured = bytearray()
+    try:
+        for chunk in iter(lambda: os.read(process.stderr.fileno(), 1 << 16), b''):
+            stderr.write(chunk)
+            stderr.flush()
+            captured += chunk
+            del captured[:-_capture_bytes]
+    except KeyboardInterrupt:
+        # Ctrl-C reaches the command as well, so wait for it to finish and still record it
+        pass
+    finally:
+        process.stderr.close()
+        returncode = process.wait()
+    duration = '{:.1f}'.format(time.monotonic() - start)
+
+    # Record the outcome beside the log instead of rewriting the entry in place
+    cmd_error = _command_error(captured) if returncode != 0 else ''
+    _record_outcome(log_path, entry, offset, returncode, cmd_error, started, duration)
+
+
+def _command_error(captured):
+    # A failed command is described by the last thing it wrote to stderr, leaving out what
+    # interactive bash itself prints when it has no terminal or exits
+    lines = [line.strip() for line in captured.decode('utf-8', 'replace').splitlines()
+             if line.strip() and line.strip() not in ('exit', 'bash: no job control in this shell')
+             and not line.startswith('bash: cannot set terminal process group')]
+    return lines[-1][-200:] if lines else ''
+
+
+# Fan-out
+#
+# 'opslog -C TEMPLATE --each [FILE]' runs the command once per target, with {target} in TEMPLATE
+# replaced by the target. Targets are read from FILE, one per line ('-' for stdin, blank lines and
+# lines starting with '#' skipped), or without FILE are the hosts of the -i range. Every target gets
+# its own entry, all appended with one locked write before any command starts. Up to --jobs commands
+# then run at once, each with its stdout and stderr in <operator>_ops_log.<entry>.out as with
+# --background. A single loop reads their stderr and reaps them, and the outcomes of the commands
+# that ended are recorded together each time it wakes, so the results have one writer.
+_fanout_jobs = 8
+
+# The most hosts an -i range is expanded to
+_fanout_hosts = 1 << 16
+
+_fanout_placeholder = '{target}'
+
+
+def _fanout_targets(source, network):
+    """Return the targets of a fan-out: the lines of source, a file name or '-' for stdin, or the hosts of network"""
+    if not source:
+        try:
+            network = ipaddress.ip_network(network.strip(), strict=False)
+        except (AttributeError, ValueError):
+            print("ERROR: --each without a FILE needs -i with an address range, such as -i 10.0.0.0/24")
+            sys.exit(1)
+        if network.num_addresses > _fanout_hosts:
+            print("ERROR: {} holds more than {} hosts, list the targets in a file instead".format(network, _fanout_hosts))
+            sys.exit(1)
+        return [str(host) for host in network.hosts()]
+
+    with (open(source, 'r') if source != '-' else sys.stdin) as targets_file:
+        targets = [line.strip() for line in targets_file if line.strip() and not line.strip().startswith('#')]
+    bad = [target for target in targets if ';' in target or len(target.split()) > 1]
+    if bad:
+        print("ERROR: each line of {} must hold one target, not '{}'".format(source, bad[0]))
+        sys.exit(1)
+    return targets
+
+
+def _fan_out(log_path, jobs, commands):
+    """Run (entry, offset, target, command) jobs, up to jobs at a time, and record their outcomes.
+
+    Prints a line per command as it ends and returns how many started and how many of those failed.
+    Ctrl-C stops new commands from starting and interrupts the running ones; the entries of those
+    that never started are recorded as interrupted.
+    """
+    pending = collections.deque(commands)
+    running = dict()
+    selector = selectors.DefaultSelector()
+    launched = failed = 0
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                entry, offset, target, command = pending.popleft()
+                output = open(_output_path(log_path, entry), 'ab')
+                started = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                # Each command gets a session of its own so the interactive shells do not fight over the terminal
+                process = subprocess.Popen(['/bin/bash', '-i', '-c', command], stdin=subprocess.DEVNULL,
+                                           stdout=output, stderr=subprocess.PIPE, start_new_session=True)
+                running[process.stderr.fileno()] = process
+                launched += 1
+                selector.register(process.stderr, selectors.EVENT_READ,
+                                  (process, entry, offset, target, output, started, time.monotonic(), bytearray()))
+
+            ended = list()
+            try:
+                ready = selector.select()
+            except KeyboardInterrupt:
+                # Let the running commands see the interrupt too, then wait for them to end
+                for process in running.values():
+                    with contextlib.suppress(ProcessLookupError):
+                        os.killpg(process.pid, signal.SIGINT)
+                stopped, pending = pending, collections.deque()
+                ended.extend((entry, offset, -signal.SIGINT, 'not run, the fan-out was interrupted', '', '')
+                             for entry, offset, _, _ in stopped)
+                ready = list()
+            for key, _ in ready:
+                process, entry, offset, target, output, started, start, captured = key.data
+                chunk = os.read(key.fd, 1 << 16)
+                if chunk:
+                    os.write(output.fileno(), chunk)
+                    captured += chunk
+                    del captured[:-_capture_bytes]
+                    continue
+
+                selector.unregister(key.fileobj)
+                del running[key.fd]
+                key.fileobj.close()
+                output.close()
+                returncode = process.wait()
+                duration = '{:.1f}'.format(time.monotonic() - start)
+                ended.append((entry, offset, returncode, _command_error(captured) if returncode else '', started, duration))
+                failed += returncode != 0
+                print("Entry {} ({}): exit {} after {}s".format(entry, target, returncode, duration))
+            if ended:
+                _record_outcomes(log_path, ended)
+    finally:
+        selector.close()
+    return launched, failed
+
+
+@_timed('command')
+def _run_fanout(template, targets, jobs, background=False, **fields):
+    """Log an entry per target for the -C template and run the commands, up to jobs at a time.
+
+    fields holds the p, f and n values every entry shares. With background the commands run from
+    a detached process and this returns once the entries are logged.
+    """
+    if _fanout_placeholder not in template:
+        print("ERROR: with --each the -C command must say where each target goes with " + _fanout_placeholder)
+        sys.exit(1)
+    if not targets:
+        print("No targets to run the command against.")
+        sys.exit()
 
+    log_path = _log_path()
+    jobs = max(jobs, 1)
     date = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    commands = [template.replace(_fanout_placeholder, target) for target in targets]
+    written = _log_entries(log_path, [[date, get_operator(), fields['f'], fields['p'], target, command, 'yes', fields['n']]
+                                      for target, command in zip(targets, commands)])
+    print("Logged {} entries ({}-{}), running {} at a time, output in {}".format(
+        len(written), written[0][0], written[-1][0], min(jobs, len(written)), _output_path(log_path, '<entry>')))
+
+    commands = [(entry, offset, target, command) for (entry, offset), target, command in zip(written, targets, commands)]
+    if background:
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid:
+            print("Running in the background (pid {})".format(pid))
+            return
+        # As with -C --background, the child lets go of the caller's terminal or pipe
+        os.setsid()
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for target in (0, 1, 2):
+                os.dup2(devnull, target)
+            os.close(devnull)
+            _fan_out(log_path, jobs, commands)
+        finally:
+            os._exit(0)
+
+    ran, failed = _fan_out(log_path, jobs, commands)
+    print("Ran {} of {} commands, {} failed".format(ran, len(commands), failed))
+
+
+# Batch ingestion
+#
+# 'opslog --batch [FILE]' logs one entry per line of FILE, or of stdin. A line is either a JSON object
+# with any of the keys date, p, i, c, n, f and executed, or the options a single call would be given:
+#     -p 3 -i 10.0.0.1 -c 'nmap -sS 10.0.0.1' -n 'port scan' -f recon
+# with --date 'YYYY-MM-DD HH:MM:SS' and --executed yes|no to import historical entries. Blank lines
+# and lines starting with '#' are skipped. Commands are never run. Every line is checked before
+# anything is written, then the batch is appended under one lock per day and synced to disk once.
+
+def _batch_parser():
+    parser = argparse.ArgumentParser(prog='--batch', add_help=False)
+    parser.add_argument('-p', type=int)
+    parser.add_argument('-i', nargs='+')
+    parser.add_argument('-c')
+    parser.add_argument('-n')
+    parser.add_argument('-f', nargs='+')
+    parser.add_argument('--date')
+    parser.add_argument('--executed', choices=['yes', 'no', ''])
+
+    # A bad line must not end the program, only be reported with the others
+    def error(message):
+        raise ValueError(message)
+    parser.error = error
+    return parser
+
+
+def _batch_entry(values, operator, now):
+    # Build the log line for one batch entry from its field values, raising ValueError if any is invalid
+    date = values.get('date') or now
+    if not isinstance(date, str) or not re.match(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$", date):
+        raise ValueError("invalid date '{}', use YYYY-MM-DD HH:MM:SS".format(date))
+    try:
+        paa = '' if values.get('p') in (None, '') else str(int(values['p']))
+    except (TypeError, ValueError):
+        raise ValueError("invalid pre-approved action number '{}'".format(values['p']))
+
+    fields = dict()
+    for name in ('i', 'c', 'f', 'n', 'executed'):
+        value = values.get(name) or ''
+        fields[name] = ' '.join(str(item) for item in value) if isinstance(value, list) else str(value)
+        if '\n' in fields[name] or '\r' in fields[name]:
+            raise ValueError("{} must be on one line".format(name))
+        if name != 'n' and ';' in fields[name]:
+            raise ValueError("';' is not allowed in {}".format(name))
+    if not values.get('executed'):
+        fields['executed'] = 'no' if fields['c'] else ''
+    elif fields['executed'] not in ('yes', 'no'):
+        raise ValueError("executed must be yes or no")
+
+    return ';'.join([date, operator, fields['f'], paa, fields['i'], fields['c'], fields['executed'], fields['n']])
+
+
+def _last_date(log_path):
+    # Date of the newest entry of the log or, if the log is empty, of its last closed segment
+    if _backend() == 'sqlite':
+        try:
+            db = _db_connect(log_path)
+        except FileNotFoundError:
+            return ''
+        try:
+            return db.execute('SELECT max(date) FROM entries').fetchone()[0] or ''
+        finally:
+            db.close()
+    try:
+        with open(log_path, 'rb') as log:
+            end = log.seek(0, os.SEEK_END)
+            log.seek(max(0, end - 4096))
+            lines = [line for line in log.read().splitlines()[1:] if line.strip()]
+    except FileNotFoundError:
+        lines = list()
+    if lines and not lines[-1].startswith(b'Date;'):
+        return lines[-1][:19].decode('utf-8', 'replace')
+    segments = _load_manifest(log_path)
+    return segments[-1][4] if segments else ''
+
+
+def _batch_log(source):
+    """Log every entry read from source, a file name or '-' for stdin, as one batch"""
+    parser = _batch_parser()
+    operator = get_operator()
+    log_path = _log_path()
+    now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    lines = list()
+    errors = list()
+    last = _last_date(log_path)
+    with (open(source, 'r') if source != '-' else sys.stdin) as batch:
+        for number, line in enumerate(batch, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if line.startswith('{'):
+                    values = json.loads(line)
+                    if not isinstance(values, dict):
+                        raise ValueError("expected a JSON object")
+                else:
+                    values = vars(parser.parse_args(shlex.split(line)))
+                new_entry = _batch_entry(values, operator, now)
+            except ValueError as e:
+                errors.append("line {}: {}".format(number, e))
+                continue
+
+            # The log is kept in date order, which time windows rely on
+            if new_entry[:19] < last:
+                errors.append("line {}: dated {}, before the entry preceding it ({})".format(number, new_entry[:19], last))
+                continue
+            last = new_entry[:19]
+            lines.append(new_entry)
+
+    if errors:
+        print(*errors, sep="\n")
+        print("No entries were logged.")
+        sys.exit(1)
+    if not lines:
+        print("No entries to log.")
+        return
+
+    if _backend() == 'sqlite':
+        entries = _db_append(log_path, [_split_entry(line) for line in lines])
+        print("Logged {} entries ({}-{})".format(len(entries), entries[0], entries[-1]))
+        return
+
+    # One locked append per day lets daily rotation close segments at the right entries
+    written = list()
+    with open(log_path, 'ab') as log:
+        for _, day in itertools.groupby(lines, key=lambda line: line[:10]):
+            written.extend(_append_entries(log, log_path, list(day)))
+        os.fsync(log.fileno())
+    print("Logged {} entries ({}-{})".format(len(written), written[0][0], written[-1][0]))
+
+
+# opslogd
+#
+# On busy hosts 'opslog --daemon' keeps the operator logs open and accepts entries over a Unix socket.
+# Each request is one JSON line {"operator": name, "entries": [entry line, ...]} and is answered
+# with {"entries": [[entry number, offset], ...]} or {"error": message}. Requests that arrive together
+# are committed to each log with a single locked write.
+_daemon_timeout = 5
+
+
+def _daemon_request(request):
+    # Send a request to opslogd and return its reply, or None if opslogd is not running
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(_daemon_timeout)
+    try:
+        client.connect(_socketfile)
+    except OSError:
+        client.close()
+        return None
+
+    try:
+        with client:
+            client.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            reply = client.makefile('rb').readline()
+        return json.loads(reply) if reply else {'error': 'connection closed'}
+    except (OSError, ValueError) as e:
+        return {'error': str(e)}
+
+
+def _daemon_commit(pending, logs):
+    # Write every pending request to its log and answer each client.
+    # pending is a list of (connection, request line); logs caches the open log of each operator
+    replies = dict()
+    batches = dict()
+    for n, (conn, line) in enumerate(pending):
+        try:
+            request = json.loads(line)
+            operator = request['operator']
+            if not operator or os.path.basename(operator) != operator:
+                raise ValueError("invalid operator name {}".format(operator))
+            new_entries = [str(entry) for entry in request['entries']]
+        except (ValueError, KeyError, TypeError) as e:
+            replies[n] = {'error': 'bad request: {}'.format(e)}
+            continue
+        batches.setdefault(operator, []).append((n, new_entries))
+
+    for operator, requests in batches.items():
+        log_path = _log_path(operator)
+        try:
+            # Reopen the log if it was removed or replaced since it was last written
+            log = logs.get(operator)
+            if log is None or os.fstat(log.fileno()).st_ino != os.stat(log_path).st_ino:
+                if log is not None:
+                    log.close()
+                log = logs[operator] = open(log_path, 'ab')
+
+            written = _append_entries(log, log_path, [entry for _, new_entries in requests for entry in new_entries])
+            for n, new_entries in requests:
+                replies[n] = {'entries': written[:len(new_entries)]}
+                written = written[len(new_entries):]
+        except OSError as e:
+            logs.pop(operator, None)
+            for n, _ in requests:
+                replies[n] = {'error': str(e)}
+
+    for n, (conn, _) in enumerate(pending):
+        try:
+            conn.settimeout(_daemon_timeout)
+            conn.sendall((json.dumps(replies[n]) + "\n").encode('utf-8'))
+            conn.setblocking(False)
+        except OSError:
+            pass
+
+
+def _run_daemon():
+    if _backend() == 'sqlite':
+        print("opslogd only serves csv logs, the sqlite backend takes concurrent writers itself")
+        sys.exit(1)
+    if _daemon_request({'operator': '', 'entries': []}) is not None:
+        print("opslogd is already running on " + _socketfile)
+        sys.exit(1)
+    if os.path.exists(_socketfile):
+        os.remove(_socketfile)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(_socketfile)
+    os.chmod(_socketfile, 0o666)
+    server.listen(socket.SOMAXCONN)
+    server.setblocking(False)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    buffers = dict()
+    logs = dict()
+    unsynced = set()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    print("opslogd listening on " + _socketfile)
+
+    try:
+        while True:
+            # Under the batch fsync policy, entries still unsynced when clients go quiet are synced then
+            events = selector.select(_durability()[2] / 1000 if unsynced else None)
+            if not events:
+                for operator in unsynced.intersection(logs):
+                    _flush_writes(logs[operator], _log_path(operator))
+                unsynced.clear()
+
+            # Collect every complete request that is ready, then commit them as one batch
+            pending = list()
+            for key, _ in events:
+                if key.fileobj is server:
+                    try:
+                        conn, _ = server.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    buffers[conn] = b''
+                    continue
+
+                conn = key.fileobj
+                try:
+                    data = conn.recv(65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''
+                if not data:
+                    selector.unregister(conn)
+                    conn.close()
+                    del buffers[conn]
+                    continue
+
+                buffers[conn] += data
+                while b'\n' in buffers[conn]:
+                    line, buffers[conn] = buffers[conn].split(b'\n', 1)
+                    pending.append((conn, line))
+
+            if pending:
+                _daemon_commit(pending, logs)
+                if _durability()[0] == 'batch':
+                    unsynced.update(logs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(_socketfile)
+        for log in logs.values():
+            log.close()
+    sys.exit()
 
-    retcode = subprocess.run(['/bin/bash', '-i', '-c', command], stderr=subprocess.PIPE)
-    if retcode.returncode > 0:
-        executed = 'no'
-        cmd_error = re.split(".*: ", str(retcode.stderr).replace("b'", '')
-                             .replace("\\n'", '').replace('\\n"', ''))[1]
-        new_entry = str(date) + ';' + get_operator() + ';' + args.f + ';' + args.p + ';' + \
-                    args.i + ';' + command + ';' + executed + ';' + args.n + " - ERROR: " + cmd_error
 
-        log = open(os.path.join(_logdir, get_operator() + "_ops_log.csv"), 'r')
-        lines = log.readlines()
-        log.close()
+def _log_entries(log_path, rows):
+    """Log entries, each a list of the 8 log fields, and return their (entry number, offset) pairs.
 
+    The database takes the fields as they are. Otherwise the entries go to opslogd if it is running,
+    or are written to the log directly, with one locked write either way.
+    """
+    if _backend() == 'sqlite':
+        return [(entry, 0) for entry in _db_append(log_path, rows)]
 
-        newlog = open(os.path.join(_logdir, get_operator() + "_ops_log.csv"), 'w')
-        for item in lines[:-1]:
-            newlog.writelines(item)
-        newlog.writelines(new_entry + "\n")
-        newlog.close()
-        print("\n".join(cmd_error.split("\\n")))
+    lines = [';'.join(fields) for fields in rows]
+    reply = _daemon_request({'operator': get_operator(), 'entries': lines})
+    if reply is None:
+        try:
+            with open(log_path, 'ab') as log:
+                return _append_entries(log, log_path, lines)
+        except OSError as e:
+            print("ERROR: could not log the entry: {}".format(e))
+            sys.exit(1)
+    if 'error' in reply:
+        print("ERROR: opslogd could not log the entry: " + reply['error'])
+        sys.exit(1)
+    return [tuple(written) for written in reply['entries']]
 
 
 def main(args):
     """This function will handle the main logging"""
 
-    new_entry = str()
-
-    # if no log exists, create one with proper header
-    if not os.path.isfile(os.path.join(_logdir, get_operator() + "_ops_log.csv")):
-        with open(os.path.join(_logdir, get_operator() + "_ops_log.csv"), 'a+') as log:
-            log.write('Date;Operator;Flag;PAA;IPs;Command Syntax;Executed;Note')
-            log.write("\n")
+    log_path = _log_path()
+    entry = offset = None
 
     date = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -495,18 +3829,25 @@ def main(args):
     executed = 'yes' if args.C else 'no' if args.c else ''
     args.n = '' if not args.n else args.n[0]
 
-    # Create entry with all provided arguments
-    new_entry = str(date) + ';' + get_operator() + ';' + args.f + ';' + args.p + ';' + \
-               args.i + ';' + command + ';' + executed + ';' + args.n
+    # With --each, log and run the command once per target instead
+    if args.each is not None:
+        if not args.C:
+            print("ERROR: --each needs a command to run given with -C")
+            sys.exit(1)
+        if args.each and args.i:
+            print("ERROR: --each takes its targets from either FILE or -i, not both")
+            sys.exit(1)
+        _run_fanout(command, _fanout_targets(args.each, args.i), args.jobs, args.background,
+                    p=args.p, f=args.f, n=args.n)
+        sys.exit()
 
-    # Write new entry to log
-    with open(os.path.join(_logdir, get_operator() + "_ops_log.csv"), 'a+') as log:
-        log.write(new_entry)
-        log.write("\n")
+    # Create entry with all provided arguments
+    fields = [str(date), get_operator(), args.f, args.p, args.i, command, executed, args.n]
+    entry, offset = _log_entries(log_path, [fields])[0]
 
     # If -C was used, execute the command
     if args.C:
-        _run_command(command)
+        _run_command(command, entry, offset, args.background)
 
     sys.exit()
 
@@ -600,13 +3941,32 @@ if __name__ == '__main__':
         type=str,
         help='Flag(s) used to tag the log entry'
     )
+    log_group.add_argument(
+        '--background',
+        action='store_true',
+        help='With -C, run the command detached, writing its output to a file, and log its outcome when it ends'
+    )
+    log_group.add_argument(
+        '--each',
+        metavar='FILE',
+        nargs='?',
+        const='',
+        help="With -C, log and run the command once per target of FILE ('-' for stdin) or host of the -i range, "
+             "with {target} in the command replaced by each"
+    )
+    log_group.add_argument(
+        '--jobs',
+        metavar='N',
+        type=int,
+        default=_fanout_jobs,
+        help='With --each, how many commands run at once (default {})'.format(_fanout_jobs)
+    )
 
     display_group = parser.add_mutually_exclusive_group()
     display_group.description = "Use the following commands to display or search the current operator log"
     display_group.add_argument(
         '--cat',
-        action='store_const',
-        const=display_log,
+        action='store_true',
         help='Output the current log (can be piped to less/more, head/tail)'
     )
     display_group.add_argument(
@@ -615,6 +3975,24 @@ if __name__ == '__main__':
         const=list_flags,
         help='List all flags used in current operators log'
     )
+    display_group.add_argument(
+        '--show',
+        metavar='N[..M]',
+        type=_entry_range,
+        help='Show entry N, or entries N to M, of the current log as numbered by --cat and -lf'
+    )
+    display_group.add_argument(
+        '--follow',
+        metavar='Flag',
+        nargs='*',
+        type=str,
+        help='Print entries as they are logged (with --tail N, the last N first), only those tagged with a Flag if given'
+    )
+    display_group.add_argument(
+        '--stats',
+        action='store_true',
+        help='Report entries per flag, PAA, target, day and hour and the failed command rate'
+    )
     display_group.add_argument(
         '-sf',
         metavar='Flag',
@@ -622,6 +4000,53 @@ if __name__ == '__main__':
         type=str,
         help='Search the log entries for those tagged with Flag(s)'
     )
+    display_group.add_argument(
+        '--grep', '--search',
+        dest='grep',
+        metavar='TEXT',
+        nargs='+',
+        type=str,
+        help='Search the notes and command syntax of the log entries for every TEXT (case insensitive)'
+    )
+    display_group.add_argument(
+        '--target',
+        metavar='a.b.c.d/f',
+        type=_network,
+        help='Show the log entries whose target ip address/range contains, overlaps or is inside a.b.c.d/f'
+    )
+    filter_group = parser.add_argument_group()
+    filter_group.description = "Use the following commands to limit --cat, -sf, --grep, --target, --stats or --export to a time window (UTC)" \
+                               " or to widen --cat, -sf, --stats or --export to every operator, and to keep only the first or last entries shown"
+    filter_group.add_argument(
+        '--since',
+        metavar='TIME',
+        type=_timestamp,
+        help='Only include entries logged at or after TIME (YYYY-MM-DD [HH[:MM[:SS]]])'
+    )
+    filter_group.add_argument(
+        '--until',
+        metavar='TIME',
+        type=_timestamp,
+        help='Only include entries logged up to and including TIME (YYYY-MM-DD [HH[:MM[:SS]]])'
+    )
+    filter_group.add_argument(
+        '--all-operators',
+        action='store_true',
+        help="Run --cat, -sf, --follow, --stats or --export over every operator's log, merged by date"
+    )
+    rows_group = filter_group.add_mutually_exclusive_group()
+    rows_group.add_argument(
+        '--head',
+        metavar='N',
+        type=int,
+        help='Only show the first N entries of --cat, -sf, --grep or --target'
+    )
+    rows_group.add_argument(
+        '--tail',
+        metavar='N',
+        type=int,
+        help='Only show the last N entries of --cat, -sf, --grep or --target, or start --follow with them'
+    )
     mgmt_group = parser.add_argument_group()
     mgmt_group.description = "Use the following commands to manage operator logs"
     mgmt_group.add_argument(
@@ -636,9 +4061,41 @@ if __name__ == '__main__':
         dest='filetype',
         nargs=1,
         type=str,
-        choices=['csv', 'json', 'default'],
+        choices=['csv', 'json', 'ndjson', 'default'],
         default='default',
-        help='format to export the operator log in (csv, json, or default)'
+        help='format to export the operator log in (csv, json, ndjson or default), gzip compressed if FILE ends in .gz'
+    )
+    mgmt_group.add_argument(
+        '--incremental',
+        action='store_true',
+        help='With --export, only add the entries logged since the last --incremental export to FILE'
+    )
+    mgmt_group.add_argument(
+        '--quarantine',
+        metavar='FILE',
+        nargs=1,
+        type=str,
+        help='With --merge, move lines that do not match the log format to FILE instead of aborting'
+    )
+    mgmt_group.add_argument(
+        '--import',
+        dest='import_log',
+        metavar='FILE',
+        nargs=1,
+        type=str,
+        help="Load the entries of the csv log FILE into the current operator's sqlite database"
+    )
+    mgmt_group.add_argument(
+        '--batch',
+        metavar='FILE',
+        nargs='?',
+        const='-',
+        help='Log one entry per line of FILE (or stdin), given as JSON or as -p/-i/-c/-n/-f options'
+    )
+    mgmt_group.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Run opslogd, which batches log entries from many shells (stop with Ctrl-C or SIGTERM)'
     )
     mgmt_group.add_argument(
         '--merge',
@@ -647,6 +4104,20 @@ if __name__ == '__main__':
         type=str,
         help='Merge multiple logs into one file'
     )
+    debug_group = parser.add_argument_group()
+    debug_group.description = "Use the following commands to see where an invocation spends its time"
+    debug_group.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print the time taken by each phase (startup, config, pandas import, parse, render, ...) to stderr'
+    )
+    debug_group.add_argument(
+        '--profile',
+        metavar='FILE',
+        nargs=1,
+        type=str,
+        help='Write a cProfile dump of the invocation (after startup) to FILE'
+    )
 
     if not len(sys.argv) > 1:
         print(_desc)
@@ -654,20 +4125,60 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    # Time the invocation if asked to, reporting when it exits however it ends
+    if args.timings or args.profile or os.environ.get(_stats_variable):
+        profiler = None
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        # The options given are read from the parsed arguments, as a value may itself start with '-'
+        options = [action.option_strings[0] for action in parser._actions if action.option_strings
+                   and getattr(args, action.dest, None) not in (None, False, action.default)]
+        atexit.register(_report_timings, time.perf_counter(), _process_age(), args.timings, profiler,
+                        args.profile[0] if args.profile else None, options)
+
+    if args.follow is not None:
+        follow_log(args.follow, args.tail or 0, args.all_operators)
+        sys.exit()
+    if args.stats:
+        show_report(log_stats(args.since, args.until, args.all_operators))
+        sys.exit()
     if args.sf:
-        print("\n" + display_log(search_log(args.sf)) + "\n")
+        show_log(_limit_rows(search_log(args.sf, args.since, args.until, args.all_operators), args.head, args.tail))
+        sys.exit()
+    if args.grep:
+        show_log(_limit_rows(grep_log(args.grep, args.since, args.until), args.head, args.tail))
+        sys.exit()
+    if args.target:
+        show_log(_limit_rows(target_log(args.target, args.since, args.until), args.head, args.tail))
         sys.exit()
     if args.set_operator:
         set_operator(args.set_operator[0])
         sys.exit()
     if args.filename:
-        _export_log(args.filename[0], args.filetype[0])
+        _export_log(args.filename[0], args.filetype[0], since=args.since, until=args.until,
+                    all_operators=args.all_operators, incremental=args.incremental)
+        sys.exit()
+    if args.batch:
+        _batch_log(args.batch)
+        sys.exit()
+    if args.import_log:
+        _import_log(args.import_log[0])
         sys.exit()
     if args.mergefile:
-        _merge_logs(args.mergefile)
+        _merge_logs(args.mergefile, args.quarantine[0] if args.quarantine else None)
+    if args.daemon:
+        _run_daemon()
+
+    if args.cat:
+        show_log(*_cat_rows(args.since, args.until, args.head, args.tail, args.all_operators))
+        sys.exit()
+    if args.show:
+        show_log(*_show_rows(*args.show))
+        sys.exit()
 
-    print(list_flags()[0], list_flags()[1]) if args.lf \
+    show_report(' '.join(list_flags())) if args.lf \
         else print(get_operator()) if args.operator \
         else print(args.list_operators()) if args.list_operators \
-        else print("\n" + display_log() + "\n") if args.cat \
         else main(args)